@@ -1,7 +1,12 @@
-from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.models.KalshiEvent import KalshiEvent
-from sqlalchemy import update, delete, select
+from database.services.batch_sizing import AdaptiveBatchSizer, max_safe_batch_size, write_in_batches
+from database.services.entity_cache import EntityCache
+from database.services.statement_cache import column_keys, normalized_values
+from database.CRUDs.conditional_writes import (
+    SEQ_COLUMN, WriteResult, conditional_upsert, dedupe_by_seq, group_by_columns, is_newer
+)
+from sqlalchemy import update, delete, select, lambda_stmt
 from typing import Optional, List, Dict
 import logging
 
@@ -9,7 +14,9 @@ import logging
 async def create_kalshi_events_bulk(
         session: AsyncSession,
         events_data: List[Dict],
-        batch_size: int = 100
+        batch_size: int = 100,
+        cache: Optional[EntityCache] = None,
+        sizer: Optional[AdaptiveBatchSizer] = None
         ) -> bool:
     """
     Асинхронно создает множество записей KalshiEvent в базе данных пакетным способом.
@@ -18,26 +25,40 @@ async def create_kalshi_events_bulk(
         session (AsyncSession): Асинхронная сессия SQLAlchemy для работы с БД
         events_data (List[Dict]): Список словарей с данными для создания событий
         batch_size (int): Размер пакета для групповой вставки (по умолчанию 100)
+        cache (EntityCache): Кеш, из которого удаляются затронутые event_ticker
+        sizer (AdaptiveBatchSizer): Подбирает размер пакетов вместо batch_size
+            по измеренной задержке; пакет, упершийся в таймаут или блокировку,
+            повторяется меньшего размера (см. write_in_batches). В любом случае
+            размер не превышает лимит bind-параметров (max_safe_batch_size)
 
     :return
         bool: True если все записи успешно добавлены, False при возникновении ошибки"""
     if not events_data:
         return True
 
-    try:
-        mapper = inspect(KalshiEvent)
-        valid_columns = {columns.key for columns in mapper.attrs}
-
-        events = []
-        for data in events_data:
-            filtered_data = {k: v for k, v in data.items() if k in valid_columns}
-            events.append(KalshiEvent(**filtered_data))
-
-        for i in range(0, len(events), batch_size):
-            session.add_all(events[i:i+batch_size])
-            await session.flush()
+    valid_columns = column_keys(KalshiEvent)
+
+    async def write(batch: List[Dict]) -> None:
+        events = [
+            KalshiEvent(**{k: v for k, v in data.items() if k in valid_columns})
+            for data in batch
+        ]
+        session.add_all(events)
+        await session.flush()
+        # Записанные объекты больше не нужны сессии
+        # (часть уже могла вытеснить ingestion_session)
+        for event in events:
+            if event in session:
+                session.expunge(event)
 
+    try:
+        await write_in_batches(
+            session, events_data, write, batch_size, max_safe_batch_size(KalshiEvent), sizer
+        )
         await session.commit()
+        if cache is not None:
+            for data in events_data:
+                cache.invalidate(KalshiEvent, data.get('event_ticker'))
         return True
     except Exception as e:
         await session.rollback()
@@ -46,7 +67,11 @@ async def create_kalshi_events_bulk(
 
 
 
-async def create_kalshi_event(session: AsyncSession, event_data: dict) -> bool:
+async def create_kalshi_event(
+        session: AsyncSession,
+        event_data: dict,
+        cache: Optional[EntityCache] = None
+        ) -> bool:
     """
     Асинхронно создает запись о событии Kalshi в базе данных.
 
@@ -57,6 +82,7 @@ async def create_kalshi_event(session: AsyncSession, event_data: dict) -> bool:
         session (AsyncSession): Асинхронная сессия SQLAlchemy для работы с БД.
         event_data (dict): Словарь с данными события. Ключи должны соответствовать
             колонкам модели KalshiEvent.
+        cache (EntityCache): Кеш, из которого удаляется event_ticker события.
 
     :return
         bool:
@@ -64,14 +90,14 @@ async def create_kalshi_event(session: AsyncSession, event_data: dict) -> bool:
             - False если произошла ошибка
     """
     try:
-        mapper = inspect(KalshiEvent)
-        valid_columns = {column.key for column in mapper.attrs}
-        filtered_data = {k: v for k, v in event_data.items() if k in valid_columns}
+        filtered_data = normalized_values(KalshiEvent, event_data)
 
         event = KalshiEvent(**filtered_data)
         session.add(event)
 
         await session.commit()
+        if cache is not None:
+            cache.invalidate(KalshiEvent, event.event_ticker)
         logging.debug(f"Successfully created event {event.ticker}")
         return True
 
@@ -81,21 +107,25 @@ async def create_kalshi_event(session: AsyncSession, event_data: dict) -> bool:
         return False
 
 
-async def update_kalshi_event(session: AsyncSession, event_id: int, event_data: dict) -> bool:
+async def update_kalshi_event(
+        session: AsyncSession,
+        event_id: int,
+        event_data: dict,
+        cache: Optional[EntityCache] = None
+        ) -> bool:
     """Асинхронно обновляет событие Kalshi
 
     :param
         session: Асинхронная сессия SQLAlchemy
         event_id: ID события для обновления
         event_data: Словарь с полями для обновления
+        cache: Кеш, из которого удаляется обновленное событие
 
     :return
         bool: True если обновление прошло успешно
     """
     try:
-        mapper = inspect(KalshiEvent)
-        valid_columns = {column.key for column in mapper.attrs}
-        filtered_data = {k: v for k, v in event_data.items() if k in valid_columns}
+        filtered_data = normalized_values(KalshiEvent, event_data)
 
         stmt = (
             update(KalshiEvent)
@@ -105,6 +135,8 @@ async def update_kalshi_event(session: AsyncSession, event_id: int, event_data:
 
         result = await session.execute(stmt)
         await session.commit()
+        if cache is not None:
+            cache.invalidate_id(KalshiEvent, event_id)
 
         if result.rowcount > 0:
             logging.debug(f"KalshiEvent {event_id} updated successfully")
@@ -118,12 +150,139 @@ async def update_kalshi_event(session: AsyncSession, event_id: int, event_data:
         return False
 
 
-async def delete_kalshi_event(session: AsyncSession, event_id: int) -> bool:
+async def update_kalshi_event_if_newer(
+        session: AsyncSession,
+        event_id: int,
+        event_data: dict,
+        source_seq: int,
+        cache: Optional[EntityCache] = None
+        ) -> WriteResult:
+    """Асинхронно обновляет событие Kalshi, только если source_seq новее сохраненного
+
+    Условие проверяется в самом UPDATE, поэтому устаревшие и пришедшие
+    не по порядку обновления отбрасываются без гонок между фидами.
+
+    :param
+        session: Асинхронная сессия SQLAlchemy
+        event_id: ID события для обновления
+        event_data: Словарь с полями для обновления
+        source_seq: Порядковый номер/время обновления в источнике
+        cache: Кеш, из которого удаляется обновленное событие
+
+    :return
+        WriteResult: applied=1 при обновлении, stale=1 если данные устарели,
+            missing=1 если события нет, error при ошибке записи
+    """
+    try:
+        filtered_data = normalized_values(KalshiEvent, {**event_data, SEQ_COLUMN: source_seq})
+
+        stmt = (
+            update(KalshiEvent)
+            .where(KalshiEvent.id == event_id, is_newer(KalshiEvent.source_seq, source_seq))
+            .values(**filtered_data)
+        )
+
+        result = await session.execute(stmt)
+        if result.rowcount > 0:
+            await session.commit()
+            if cache is not None:
+                cache.invalidate_id(KalshiEvent, event_id)
+            logging.debug(f"KalshiEvent {event_id} updated to seq {source_seq}")
+            return WriteResult(applied=1)
+
+        exists = await session.scalar(select(KalshiEvent.id).where(KalshiEvent.id == event_id))
+        await session.commit()
+        if exists is not None:
+            logging.debug(f"KalshiEvent {event_id} update with seq {source_seq} is stale")
+            return WriteResult(stale=1)
+        logging.debug(f"KalshiEvent {event_id} not found")
+        return WriteResult(missing=1)
+
+    except Exception as e:
+        logging.error(f"Error updating KalshiEvent: {e}")
+        await session.rollback()
+        return WriteResult(error=str(e))
+
+
+async def upsert_kalshi_events(
+        session: AsyncSession,
+        events_data: List[Dict],
+        batch_size: int = 100,
+        cache: Optional[EntityCache] = None,
+        sizer: Optional[AdaptiveBatchSizer] = None
+        ) -> WriteResult:
+    """
+    Асинхронно вставляет или обновляет события Kalshi по ticker с учетом source_seq.
+
+    Существующая строка обновляется, только если входящий source_seq новее
+    сохраненного (строки без source_seq применяются безусловно). Повторы
+    одного ticker в events_data схлопываются до самого свежего.
+
+    :param:
+        session (AsyncSession): Асинхронная сессия SQLAlchemy для работы с БД
+        events_data (List[Dict]): Список словарей с данными событий
+        batch_size (int): Количество строк в одном INSERT
+        cache (EntityCache): Кеш, из которого удаляются затронутые event_ticker
+        sizer (AdaptiveBatchSizer): Подбирает количество строк в одном INSERT
+            вместо batch_size (как в create_kalshi_events_bulk)
+
+    :return
+        WriteResult: applied - вставлено или обновлено, stale - отброшено как устаревшее,
+            error - текст ошибки, если пакет не записан (ok=False)
+    """
+    if not events_data:
+        return WriteResult()
+
+    try:
+        rounds, _ = dedupe_by_seq(
+            [normalized_values(KalshiEvent, data) for data in events_data], 'ticker'
+        )
+
+        touched = []
+        dialect_name = session.get_bind().dialect.name
+
+        async def write(batch: List[Dict]) -> None:
+            batch_touched = []
+            for group in group_by_columns(batch):
+                stmt = conditional_upsert(
+                    KalshiEvent, group, 'ticker', KalshiEvent.event_ticker, dialect_name=dialect_name
+                )
+                result = await session.execute(stmt)
+                batch_touched.extend(result.scalars().all())
+            # Пакет, откаченный до savepoint, повторяется и не должен учитываться дважды
+            touched.extend(batch_touched)
+
+        for rows in rounds:
+            await write_in_batches(
+                session, rows, write, batch_size, max_safe_batch_size(KalshiEvent), sizer
+            )
+
+        await session.commit()
+        if cache is not None:
+            for event_ticker in touched:
+                cache.invalidate(KalshiEvent, event_ticker)
+
+        stale = len(events_data) - len(touched)
+        logging.debug(f"Upserted {len(touched)} KalshiEvents, {stale} stale")
+        return WriteResult(applied=len(touched), stale=stale)
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"Bulk upsert failed {str(e)}")
+        return WriteResult(error=str(e))
+
+
+async def delete_kalshi_event(
+        session: AsyncSession,
+        event_id: int,
+        cache: Optional[EntityCache] = None
+        ) -> bool:
     """Асинхронно удаляет событие Kalshi"""
     try:
-        stmt = delete(KalshiEvent).where(KalshiEvent.id == event_id)
+        stmt = lambda_stmt(lambda: delete(KalshiEvent).where(KalshiEvent.id == event_id))
         result = await session.execute(stmt)
         await session.commit()
+        if cache is not None:
+            cache.invalidate_id(KalshiEvent, event_id)
 
         if result.rowcount > 0:
             logging.debug(f"KalshiEvent {event_id} deleted successfully")
@@ -137,10 +296,23 @@ async def delete_kalshi_event(session: AsyncSession, event_id: int) -> bool:
         return False
 
 
-async def get_kalshi_event_by_ticker(session: AsyncSession, ticker: str) -> Optional[KalshiEvent]:
-    """Асинхронно получает событие Kalshi по тикеру"""
+async def get_kalshi_event_by_ticker(
+        session: AsyncSession,
+        ticker: str,
+        cache: Optional[EntityCache] = None
+        ) -> Optional[KalshiEvent]:
+    """Асинхронно получает событие Kalshi по тикеру
+
+    С переданным cache возвращает неизменяемый снимок события
+    (см. entity_cache.snapshot), а одновременные запросы одного тикера
+    выполняются одним запросом к БД.
+    """
+    if cache is not None:
+        return await cache.get_or_load(
+            KalshiEvent, ticker, lambda: get_kalshi_event_by_ticker(session, ticker)
+        )
     try:
-        stmt = select(KalshiEvent).where(KalshiEvent.event_ticker == ticker)
+        stmt = lambda_stmt(lambda: select(KalshiEvent).where(KalshiEvent.event_ticker == ticker))
         result = await session.execute(stmt)
         event = result.scalar_one_or_none()
 
@@ -3,12 +3,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import json
 from database.models import KalshiEvent, PolyMarketEvent
 from database.models.MappingEvent import MappingEvent
-from sqlalchemy import update, delete, select, distinct
-from typing import Optional, List, Sequence
+from sqlalchemy import update, delete, select, distinct, lambda_stmt
+from sqlalchemy.exc import IntegrityError
+from typing import Iterable, Optional, List, Sequence
 import logging
 from sqlalchemy.orm import joinedload
 
 
+# Идентификаторов в одном IN: с запасом ниже лимита параметров SQLite и asyncpg
+GRAPH_CHUNK_SIZE = 10_000
+
+
 async def create_mapping_event(
         session: AsyncSession,
         kalshi_id: int,
@@ -93,6 +98,14 @@ async def create_mapping_event(
         await session.rollback()
         return None
 
+    except IntegrityError:
+        logging.warning(
+            f"Validation error creating mapping: mapping Kalshi:{kalshi_id} ↔ "
+            f"Polymarket:{polymarket_id}({polymarket_outcome}) already exists"
+        )
+        await session.rollback()
+        return None
+
     except Exception as e:
         logging.error(f"Unexpected error creating mapping: {str(e)}", exc_info=True)
         await session.rollback()
@@ -105,8 +118,8 @@ async def get_mapping_by_ids(
 ) -> Optional[MappingEvent]:
     """Получает связь по ID событий"""
     try:
-        stmt = (
-            select(MappingEvent)
+        stmt = lambda_stmt(
+            lambda: select(MappingEvent)
             .where(
                 MappingEvent.kalshi_id == kalshi_id,
                 MappingEvent.polymarket_id == polymarket_id
@@ -126,30 +139,61 @@ async def get_mapping_by_kalshi_id(
         session: AsyncSession,
         kalshi_id: int
         ) -> Sequence[MappingEvent]:
-    """Получает все связи для события Kalshi"""
-    try:
-        stmt = select(MappingEvent).where(
-            MappingEvent.kalshi_event == kalshi_id
-        )
-        result = await session.execute(stmt)
-        return result.scalars().all()
-    except Exception as e:
-        logging.error(f"Error getting mapping by Kalshi ID: {str(e)}")
-        return []
+    """Получает все связи для события Kalshi вместе с обоими событиями"""
+    return await get_mapping_graph(session, kalshi_ids=[kalshi_id])
 
 async def get_mapping_by_polymarket_id(
         session: AsyncSession,
         polymarket_id: int
         )-> Sequence[MappingEvent]:
-    """Получает все связи для события Polymarket"""
+    """Получает все связи для события Polymarket вместе с обоими событиями"""
+    return await get_mapping_graph(session, polymarket_ids=[polymarket_id])
+
+async def get_mapping_graph(
+        session: AsyncSession,
+        kalshi_ids: Optional[Iterable[int]] = None,
+        polymarket_ids: Optional[Iterable[int]] = None,
+        chunk_size: int = GRAPH_CHUNK_SIZE
+        ) -> List[MappingEvent]:
+    """
+    Получает связи для набора событий Kalshi и/или Polymarket
+    с загруженными kalshi_event и polymarket_event.
+
+    События подгружаются через joinedload (many-to-one), поэтому выполняется
+    один запрос на каждые chunk_size идентификаторов независимо от числа
+    найденных связей, а обращение к связям не вызывает ленивых загрузок.
+
+    Args:
+        session: Асинхронная сессия SQLAlchemy
+        kalshi_ids: ID событий Kalshi
+        polymarket_ids: ID событий Polymarket
+        chunk_size: Максимум идентификаторов в одном IN (лимит параметров запроса)
+
+    Returns:
+        Связи, затрагивающие любое из переданных событий, упорядоченные по id
+    """
+    filters = [
+        (MappingEvent.kalshi_id, sorted(set(kalshi_ids or ()))),
+        (MappingEvent.polymarket_id, sorted(set(polymarket_ids or ()))),
+    ]
     try:
-        stmt = select(MappingEvent).where(
-            MappingEvent.polymarket_event == polymarket_id
-        )
-        result = await session.execute(stmt)
-        return result.scalars().all()
+        mappings = {}
+        for column, ids in filters:
+            for start in range(0, len(ids), chunk_size):
+                stmt = (
+                    select(MappingEvent)
+                    .where(column.in_(ids[start:start + chunk_size]))
+                    .options(
+                        joinedload(MappingEvent.kalshi_event),
+                        joinedload(MappingEvent.polymarket_event)
+                    )
+                )
+                result = await session.execute(stmt)
+                for mapping in result.scalars():
+                    mappings[mapping.id] = mapping
+        return [mappings[mapping_id] for mapping_id in sorted(mappings)]
     except Exception as e:
-        logging.error(f"Error getting mapping by Polymarket ID: {str(e)}")
+        logging.error(f"Error getting mapping graph: {str(e)}")
         return []
 
 
@@ -193,7 +237,7 @@ async def delete_mapping(
         mapping_id: int
         ) -> bool:
     try:
-        stmt = delete(MappingEvent).where(MappingEvent.id == mapping_id)
+        stmt = lambda_stmt(lambda: delete(MappingEvent).where(MappingEvent.id == mapping_id))
         result = await session.execute(stmt)
         await session.commit()
 
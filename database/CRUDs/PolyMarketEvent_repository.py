@@ -1,115 +1,164 @@
-from sqlalchemy import inspect, update, delete, select
+from sqlalchemy import inspect, update, delete, select, lambda_stmt
 from database.models.PolyMarketEvent import PolyMarketEvent
+from database.services.batch_sizing import AdaptiveBatchSizer, max_safe_batch_size, write_in_batches
+from database.services.entity_cache import EntityCache
+from database.services.statement_cache import normalized_values
+from database.CRUDs.conditional_writes import (
+    SEQ_COLUMN, WriteResult, conditional_upsert, dedupe_by_seq, group_by_columns, is_newer
+)
 from typing import Optional, Dict, Any, List
 import logging
 
 import json
 from datetime import datetime, timezone
+from functools import lru_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 import sqlalchemy
 
 
+def _to_int(value: Any) -> int:
+    """int без потери точности больших значений (source_seq): float() только для строк вида '1.0'"""
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return int(float(value))
+    return int(value)
+
+
+@lru_cache(maxsize=None)
+def _polymarket_columns_info() -> Dict[str, Dict[str, Any]]:
+    """Column information including exact SQL type"""
+    mapper = inspect(PolyMarketEvent)
+    return {
+        col.key: {
+            'type': col.type.python_type,
+            'sql_type': str(col.type),
+            'is_datetime': isinstance(col.type, (sqlalchemy.DateTime, sqlalchemy.Date)),
+            'is_tz_aware': 'WITH TIME ZONE' in str(col.type)
+        }
+        for col in mapper.columns
+        if col.key != 'id'
+    }
+
+
+def _coerce_polymarket_row(data: Dict, columns_info: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Filters unknown keys and converts raw API values to the column types"""
+    filtered_data = {}
+    for key, value in data.items():
+        if key not in columns_info:
+            continue
+
+        col_info = columns_info[key]
+
+        # Handle None values
+        if value is None:
+            filtered_data[key] = None
+            continue
+
+        try:
+            # Special handling for datetime fields
+            if col_info['is_datetime']:
+                if isinstance(value, str):
+                    # Parse string to datetime
+                    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+                    # Convert to timezone-naive if needed
+                    if not col_info['is_tz_aware']:
+                        if dt.tzinfo is not None:
+                            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+                    else:
+                        if dt.tzinfo is None:
+                            dt = dt.replace(tzinfo=timezone.utc)
+
+                    filtered_data[key] = dt
+                elif isinstance(value, datetime):
+                    # Convert existing datetime objects
+                    if not col_info['is_tz_aware']:
+                        if value.tzinfo is not None:
+                            filtered_data[key] = value.astimezone(timezone.utc).replace(tzinfo=None)
+                        else:
+                            filtered_data[key] = value
+                    else:
+                        if value.tzinfo is None:
+                            filtered_data[key] = value.replace(tzinfo=timezone.utc)
+                        else:
+                            filtered_data[key] = value
+                else:
+                    filtered_data[key] = None
+
+            # Handle numeric types
+            elif col_info['type'] is float:
+                filtered_data[key] = float(value)
+            elif col_info['type'] is int:
+                filtered_data[key] = _to_int(value) if value else 0
+
+            # Handle boolean types
+            elif col_info['type'] is bool:
+                filtered_data[key] = bool(value)
+
+            # Handle JSON serializable types
+            elif isinstance(value, (list, dict)):
+                filtered_data[key] = json.dumps(value)
+
+            # Default string conversion
+            else:
+                filtered_data[key] = str(value)
+
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Conversion failed for {key}={value}: {str(e)}")
+            filtered_data[key] = None
+
+    return filtered_data
+
+
 async def create_polymarket_events_bulk(
         session: AsyncSession,
         events_data: List[Dict],
-        batch_size: int = 100
+        batch_size: int = 100,
+        cache: Optional[EntityCache] = None,
+        sizer: Optional[AdaptiveBatchSizer] = None
 ) -> bool:
     """
     Final robust solution with complete datetime handling
+
+    Rows are coerced and turned into ORM objects one batch at a time, so
+    only batch_size objects are built between flushes.
+
+    cache: if given, conditionIds of the inserted rows are invalidated after commit
+
+    sizer: if given, picks batch sizes from measured flush latency instead of
+    batch_size, and a batch that hits a timeout or lock wait is rolled back to
+    its savepoint and retried smaller (see write_in_batches). Batches never
+    exceed the bind parameter limit either way.
     """
     if not events_data:
         return True
 
-    try:
-        # Get column information including exact SQL type
-        mapper = inspect(PolyMarketEvent)
-        columns_info = {
-            col.key: {
-                'type': col.type.python_type,
-                'sql_type': str(col.type),
-                'is_datetime': isinstance(col.type, (sqlalchemy.DateTime, sqlalchemy.Date)),
-                'is_tz_aware': 'WITH TIME ZONE' in str(col.type)
-            }
-            for col in mapper.columns
-            if col.key != 'id'
-        }
+    columns_info = _polymarket_columns_info()
 
+    async def write(batch: List[Dict]) -> None:
         events = []
-        for data in events_data:
-            filtered_data = {}
-            for key, value in data.items():
-                if key not in columns_info:
-                    continue
-
-                col_info = columns_info[key]
-
-                # Handle None values
-                if value is None:
-                    filtered_data[key] = None
-                    continue
-
-                try:
-                    # Special handling for datetime fields
-                    if col_info['is_datetime']:
-                        if isinstance(value, str):
-                            # Parse string to datetime
-                            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-
-                            # Convert to timezone-naive if needed
-                            if not col_info['is_tz_aware']:
-                                if dt.tzinfo is not None:
-                                    dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
-                            else:
-                                if dt.tzinfo is None:
-                                    dt = dt.replace(tzinfo=timezone.utc)
-
-                            filtered_data[key] = dt
-                        elif isinstance(value, datetime):
-                            # Convert existing datetime objects
-                            if not col_info['is_tz_aware']:
-                                if value.tzinfo is not None:
-                                    filtered_data[key] = value.astimezone(timezone.utc).replace(tzinfo=None)
-                                else:
-                                    filtered_data[key] = value
-                            else:
-                                if value.tzinfo is None:
-                                    filtered_data[key] = value.replace(tzinfo=timezone.utc)
-                                else:
-                                    filtered_data[key] = value
-                        else:
-                            filtered_data[key] = None
-
-                    # Handle numeric types
-                    elif col_info['type'] is float:
-                        filtered_data[key] = float(value)
-                    elif col_info['type'] is int:
-                        filtered_data[key] = int(float(value)) if value else 0
-
-                    # Handle boolean types
-                    elif col_info['type'] is bool:
-                        filtered_data[key] = bool(value)
-
-                    # Handle JSON serializable types
-                    elif isinstance(value, (list, dict)):
-                        filtered_data[key] = json.dumps(value)
-
-                    # Default string conversion
-                    else:
-                        filtered_data[key] = str(value)
-
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"Conversion failed for {key}={value}: {str(e)}")
-                    filtered_data[key] = None
-
+        for data in batch:
+            filtered_data = _coerce_polymarket_row(data, columns_info)
             if filtered_data:
                 events.append(PolyMarketEvent(**filtered_data))
+        session.add_all(events)
+        await session.flush()
+        # Записанные объекты больше не нужны сессии
+        # (часть уже могла вытеснить ingestion_session)
+        for event in events:
+            if event in session:
+                session.expunge(event)
 
-        # Batch insert
-        for i in range(0, len(events), batch_size):
-            session.add_all(events[i:i + batch_size])
-            await session.flush()
-
+    try:
+        await write_in_batches(
+            session, events_data, write, batch_size, max_safe_batch_size(PolyMarketEvent), sizer
+        )
         await session.commit()
+        if cache is not None:
+            for data in events_data:
+                cache.invalidate(PolyMarketEvent, data.get('conditionId'))
         return True
 
     except Exception as e:
@@ -118,18 +167,16 @@ async def create_polymarket_events_bulk(
         return False
 
 
-
 async def update_poly_market_event(
         session: AsyncSession,
         condition_id: str,
-        event_data: Dict[str, Any]
+        event_data: Dict[str, Any],
+        cache: Optional[EntityCache] = None
 ) -> bool:
     """Асинхронно обновляет событие PolyMarket"""
     try:
-        # Фильтруем данные
-        mapper = inspect(PolyMarketEvent)
-        valid_columns = {column.key for column in mapper.attrs}
-        filtered_data = {k: v for k, v in event_data.items() if k in valid_columns}
+        # Фильтруем данные и упорядочиваем колонки для кеша компиляции
+        filtered_data = normalized_values(PolyMarketEvent, event_data)
 
         if not filtered_data:
             logging.warning("No valid fields to update")
@@ -137,12 +184,14 @@ async def update_poly_market_event(
 
         stmt = (
             update(PolyMarketEvent)
-            .where(PolyMarketEvent.condition_id == condition_id)
+            .where(PolyMarketEvent.conditionId == condition_id)
             .values(**filtered_data)
         )
 
         result = await session.execute(stmt)
         await session.commit()
+        if cache is not None:
+            cache.invalidate(PolyMarketEvent, condition_id)
 
         if result.rowcount > 0:
             logging.info(f"Event {condition_id} updated successfully")
@@ -157,19 +206,136 @@ async def update_poly_market_event(
         return False
 
 
+async def update_poly_market_event_if_newer(
+        session: AsyncSession,
+        condition_id: str,
+        event_data: Dict[str, Any],
+        source_seq: int,
+        cache: Optional[EntityCache] = None
+) -> WriteResult:
+    """Асинхронно обновляет событие PolyMarket, только если source_seq новее сохраненного
+
+    :return
+        WriteResult: applied=1 при обновлении, stale=1 если данные устарели,
+            missing=1 если события нет, error при ошибке записи
+    """
+    try:
+        filtered_data = normalized_values(PolyMarketEvent, {**event_data, SEQ_COLUMN: source_seq})
+
+        stmt = (
+            update(PolyMarketEvent)
+            .where(
+                PolyMarketEvent.conditionId == condition_id,
+                is_newer(PolyMarketEvent.source_seq, source_seq)
+            )
+            .values(**filtered_data)
+        )
+
+        result = await session.execute(stmt)
+        if result.rowcount > 0:
+            await session.commit()
+            if cache is not None:
+                cache.invalidate(PolyMarketEvent, condition_id)
+            logging.debug(f"Event {condition_id} updated to seq {source_seq}")
+            return WriteResult(applied=1)
+
+        exists = await session.scalar(
+            select(PolyMarketEvent.id).where(PolyMarketEvent.conditionId == condition_id)
+        )
+        await session.commit()
+        if exists is not None:
+            logging.debug(f"Event {condition_id} update with seq {source_seq} is stale")
+            return WriteResult(stale=1)
+        logging.warning(f"Event {condition_id} not found")
+        return WriteResult(missing=1)
+
+    except Exception as e:
+        logging.error(f"Error updating event: {str(e)}")
+        await session.rollback()
+        return WriteResult(error=str(e))
+
+
+async def upsert_polymarket_events(
+        session: AsyncSession,
+        events_data: List[Dict],
+        batch_size: int = 100,
+        cache: Optional[EntityCache] = None,
+        sizer: Optional[AdaptiveBatchSizer] = None
+) -> WriteResult:
+    """
+    Inserts or updates Polymarket events by conditionId, honouring source_seq.
+
+    Values are coerced like in create_polymarket_events_bulk. An existing row
+    is only overwritten when the incoming source_seq is newer, checked inside
+    the INSERT ... ON CONFLICT statement. Duplicate conditionIds in
+    events_data collapse to the freshest one.
+
+    sizer: if given, picks the rows per INSERT instead of batch_size, as in
+    create_polymarket_events_bulk
+
+    :return
+        WriteResult: applied - inserted or updated rows, stale - rejected as stale,
+            error - failure message when nothing was written (ok is False)
+    """
+    if not events_data:
+        return WriteResult()
+
+    try:
+        columns_info = _polymarket_columns_info()
+        rounds, _ = dedupe_by_seq(
+            [_coerce_polymarket_row(data, columns_info) for data in events_data], 'conditionId'
+        )
+
+        touched = []
+        dialect_name = session.get_bind().dialect.name
+
+        async def write(batch: List[Dict]) -> None:
+            batch_touched = []
+            for group in group_by_columns(batch):
+                stmt = conditional_upsert(
+                    PolyMarketEvent, group, 'conditionId', PolyMarketEvent.conditionId, dialect_name=dialect_name
+                )
+                result = await session.execute(stmt)
+                batch_touched.extend(result.scalars().all())
+            # A batch rolled back to its savepoint is retried and must not be counted twice
+            touched.extend(batch_touched)
+
+        for rows in rounds:
+            await write_in_batches(
+                session, rows, write, batch_size, max_safe_batch_size(PolyMarketEvent), sizer
+            )
+
+        await session.commit()
+        if cache is not None:
+            for condition_id in touched:
+                cache.invalidate(PolyMarketEvent, condition_id)
+
+        stale = len(events_data) - len(touched)
+        logging.debug(f"Upserted {len(touched)} Polymarket events, {stale} stale")
+        return WriteResult(applied=len(touched), stale=stale)
+
+    except Exception as e:
+        await session.rollback()
+        logging.error(f"Bulk upsert failed: {str(e)}", exc_info=True)
+        return WriteResult(error=str(e))
+
+
 async def delete_poly_market_event(
         session: AsyncSession,
-        condition_id: str
+        condition_id: str,
+        cache: Optional[EntityCache] = None
 ) -> bool:
     """Асинхронно удаляет событие PolyMarket"""
     try:
-        stmt = (
-            delete(PolyMarketEvent)
-            .where(PolyMarketEvent.condition_id == condition_id)
+        stmt = lambda_stmt(
+            lambda: delete(PolyMarketEvent)
+            .where(PolyMarketEvent.conditionId == condition_id)
         )
 
         result = await session.execute(stmt)
         await session.commit()
+        if cache is not None:
+            cache.invalidate(PolyMarketEvent, condition_id)
 
         if result.rowcount > 0:
             logging.info(f"Event {condition_id} deleted successfully")
@@ -186,13 +352,23 @@ async def delete_poly_market_event(
 
 async def get_poly_market_event(
         session: AsyncSession,
-        condition_id: str
+        condition_id: str,
+        cache: Optional[EntityCache] = None
 ) -> Optional[PolyMarketEvent]:
-    """Асинхронно получает событие PolyMarket по condition_id"""
+    """Асинхронно получает событие PolyMarket по condition_id
+
+    С переданным cache возвращает неизменяемый снимок события
+    (см. entity_cache.snapshot), а одновременные запросы одного condition_id
+    выполняются одним запросом к БД.
+    """
+    if cache is not None:
+        return await cache.get_or_load(
+            PolyMarketEvent, condition_id, lambda: get_poly_market_event(session, condition_id)
+        )
     try:
-        stmt = (
-            select(PolyMarketEvent)
-            .where(PolyMarketEvent.condition_id == condition_id)
+        stmt = lambda_stmt(
+            lambda: select(PolyMarketEvent)
+            .where(PolyMarketEvent.conditionId == condition_id)
         )
 
         result = await session.execute(stmt)
@@ -0,0 +1,120 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import ColumnElement
+
+
+SEQ_COLUMN = 'source_seq'
+UPDATED_AT_COLUMN = 'updated_at'
+
+
+class WriteResult(NamedTuple):
+    """Итог условной записи: применено, отброшено как устаревшее, не найдено, ошибка"""
+    applied: int = 0
+    stale: int = 0
+    missing: int = 0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """False, если запись не удалась (в отличие от пустого пакета)"""
+        return self.error is None
+
+
+def is_newer(current: ColumnElement, incoming: Any) -> ColumnElement:
+    """Условие применения записи: у строки еще нет source_seq или он меньше входящего"""
+    return or_(current.is_(None), current < incoming)
+
+
+def dedupe_by_seq(rows: List[Dict], key: str) -> Tuple[List[List[Dict]], int]:
+    """
+    Схлопывает повторы ключа в пакете и раскладывает строки по раундам.
+
+    Повторы одного ключа в пакете типичны при переподключении фидов,
+    а ON CONFLICT не может обновить одну строку дважды за запрос. Идущие
+    подряд строки одного ключа с source_seq схлопываются до самой свежей.
+    Строки без source_seq применяются безусловно, поэтому сохраняются
+    вместе со своим местом в порядке прихода: i-й раунд содержит i-ю
+    оставшуюся строку каждого ключа, и раунды выполняются по очереди.
+
+    :return
+        (раунды уникальных по ключу строк, количество отброшенных повторов)
+    """
+    per_key: Dict[Any, List[Dict]] = {}
+    dropped = 0
+    for row in rows:
+        pending = per_key.setdefault(row.get(key), [])
+        previous = pending[-1] if pending else None
+        if (
+                previous is not None
+                and previous.get(SEQ_COLUMN) is not None
+                and row.get(SEQ_COLUMN) is not None
+        ):
+            dropped += 1
+            if previous[SEQ_COLUMN] <= row[SEQ_COLUMN]:
+                pending[-1] = row
+            continue
+        pending.append(row)
+
+    rounds: List[List[Dict]] = []
+    for pending in per_key.values():
+        for index, row in enumerate(pending):
+            if index == len(rounds):
+                rounds.append([])
+            rounds[index].append(row)
+    return rounds, dropped
+
+
+def group_by_columns(rows: List[Dict]) -> List[List[Dict]]:
+    """Группирует строки по набору колонок: многострочный INSERT требует одинаковых ключей"""
+    groups: Dict[Tuple[str, ...], List[Dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return list(groups.values())
+
+
+def dialect_insert(dialect_name: str):
+    """insert() с поддержкой ON CONFLICT для PostgreSQL или SQLite"""
+    if dialect_name == 'sqlite':
+        return sqlite.insert
+    if dialect_name == 'postgresql':
+        return postgresql.insert
+    raise NotImplementedError(f"Upsert is not supported for dialect '{dialect_name}'")
+
+
+def conditional_upsert(
+        model,
+        rows: List[Dict],
+        key: str,
+        *returning: ColumnElement,
+        dialect_name: str = 'postgresql'
+):
+    """
+    INSERT ... ON CONFLICT (key) DO UPDATE ... WHERE <входящий source_seq новее>.
+
+    Условие проверяется внутри SQL, поэтому гонки между фидами не приводят
+    к перезаписи свежих данных. Строки без source_seq применяются безусловно
+    и не затирают сохраненный source_seq. Все строки должны иметь одинаковый
+    набор ключей (см. group_by_columns).
+    """
+    table = model.__table__
+    stmt = dialect_insert(dialect_name)(model).values(rows)
+    current_seq = table.c[SEQ_COLUMN]
+    incoming_seq = stmt.excluded[SEQ_COLUMN]
+
+    update_columns = {
+        name: stmt.excluded[name]
+        for name in rows[0]
+        if name not in (key, 'id', SEQ_COLUMN)
+    }
+    update_columns[SEQ_COLUMN] = func.coalesce(incoming_seq, current_seq)
+    # onupdate не применяется к ON CONFLICT DO UPDATE, задаем явно
+    if UPDATED_AT_COLUMN in table.c:
+        update_columns[UPDATED_AT_COLUMN] = func.now()
+
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[key]],
+        set_=update_columns,
+        where=or_(incoming_seq.is_(None), is_newer(current_seq, incoming_seq)),
+    ).returning(*returning)
@@ -0,0 +1,23 @@
+from database.models.base import Base
+from sqlalchemy import Column, BigInteger, String, Text, DateTime, func
+
+
+class ChangeLog(Base):
+    """
+    Журнал изменений, заполняется триггерами из database/services/notifications.py.
+
+    Одна запись на SQL-оператор: ключи всех затронутых строк и объединение
+    измененных колонок.
+    """
+    __tablename__ = 'change_log'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Идентификатор транзакции (pg_current_xact_id), задает порядок догрузки
+    txid = Column(BigInteger, nullable=False, index=True)
+    table_name = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    row_keys = Column(Text, nullable=False)  # JSON список ключей строк
+    changed_columns = Column(Text)  # JSON список измененных колонок
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<ChangeLog(id={self.id}, table_name='{self.table_name}', operation='{self.operation}')>"
@@ -1,5 +1,5 @@
 from database.models.base import Base
-from sqlalchemy import Column, Integer, String, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, Index, func
 from sqlalchemy.orm import relationship
 
 
@@ -7,8 +7,8 @@ class KalshiEvent(Base):
     __tablename__ = 'kalshi_events'
     id = Column(Integer, primary_key=True, autoincrement=True)
     ticker = Column(String, unique=True)
-    event_ticker = Column(String)
-    series_ticker = Column(String)
+    event_ticker = Column(String, index=True)
+    series_ticker = Column(String, index=True)
     sub_title = Column(String)
     subtitle = Column(String)
     title = Column(Text)
@@ -24,7 +24,7 @@ class KalshiEvent(Base):
     expiration_time = Column(String)
     latest_expiration_time = Column(String)
     settlement_timer_seconds = Column(Integer)
-    status = Column(String)
+    status = Column(String, index=True)
     response_price_units = Column(String)
     notional_value = Column(Integer)
     tick_size = Column(Integer)
@@ -44,6 +44,23 @@ class KalshiEvent(Base):
     risk_limit_cents = Column(Integer)
     rules_primary = Column(Text)
     rules_secondary = Column(Text)
+    # Порядковый номер/время источника последней примененной записи
+    source_seq = Column(BigInteger)
+    # Время последнего изменения строки (watermark инкрементального экспорта и репликации)
+    updated_at = Column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now(), index=True
+    )
+
+    __table_args__ = (
+        # Частичный индекс только по открытым рынкам
+        Index(
+            'ix_kalshi_events_open_series',
+            'series_ticker',
+            'event_ticker',
+            postgresql_where=status.in_(['open', 'active']),
+            sqlite_where=status.in_(['open', 'active'])
+        ),
+    )
 
     mappings = relationship(
         "MappingEvent",
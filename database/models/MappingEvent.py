@@ -1,16 +1,31 @@
 from database.models.base import Base
-from sqlalchemy import ForeignKey, Column, Integer, String
+from sqlalchemy import ForeignKey, Column, Integer, String, DateTime, Index, func
 from sqlalchemy.orm import relationship
 
 
 class MappingEvent(Base):
     __tablename__='mapping_events'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    kalshi_id = Column(Integer, ForeignKey("kalshi_events.id"), index=True)
+    # Поиск по kalshi_id обслуживает уникальный индекс ниже (kalshi_id - его первая колонка)
+    kalshi_id = Column(Integer, ForeignKey("kalshi_events.id"))
     polymarket_id = Column(Integer, ForeignKey("polymarket_events.id"), index=True)
     polymarket_outcome = Column(String, nullable=False)
     polymarket_clobTokenId = Column(String, nullable=False)
     kalshi_ticker = Column(String, nullable=False)
+    # Время последнего изменения строки (watermark инкрементального экспорта и репликации)
+    updated_at = Column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now(), index=True
+    )
+
+    __table_args__ = (
+        Index(
+            'uq_mapping_events_pair_outcome',
+            'kalshi_id',
+            'polymarket_id',
+            'polymarket_outcome',
+            unique=True
+        ),
+    )
     # Обратные ссылкив
     kalshi_event = relationship("KalshiEvent", back_populates="mappings")
     polymarket_event = relationship("PolyMarketEvent", back_populates="mappings")
@@ -1,5 +1,5 @@
 from database.models.base import Base
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, Date
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, Float, Date, Index, func
 from sqlalchemy.orm import relationship
 
 
@@ -7,7 +7,7 @@ class PolyMarketEvent(Base):
     __tablename__ = 'polymarket_events'
     id = Column(Integer, primary_key=True, autoincrement=True)
     conditionId = Column(String, unique=True)
-    slug = Column(String)
+    slug = Column(String, index=True)
     ticker = Column(String)
     startDate = Column(String)
     endDate = Column(String)
@@ -69,6 +69,23 @@ class PolyMarketEvent(Base):
     # electiontype = Column(String)
     pendingDeployment = Column(Boolean)
     # pendingdeployment = Column(Boolean)  # TODO переписать что бы под виндовс регистр был мелкий, под лиукнс CamelCase
+    # Порядковый номер/время источника последней примененной записи
+    source_seq = Column(BigInteger)
+    # Время последнего изменения строки (watermark инкрементального экспорта и репликации)
+    updated_at = Column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now(), index=True
+    )
+
+    __table_args__ = (
+        # Частичный индекс только по активным незакрытым рынкам
+        Index(
+            'ix_polymarket_events_active_open',
+            'conditionId',
+            'acceptingOrders',
+            postgresql_where=active & ~closed,
+            sqlite_where=active & ~closed
+        ),
+    )
 
     mappings = relationship(
         "MappingEvent",
@@ -77,7 +94,7 @@ class PolyMarketEvent(Base):
     )
 
     def __repr__(self):
-        return f"<PolyMarketEvent(id={self.id}, condition_id='{self.condition_id}')>"
+        return f"<PolyMarketEvent(id={self.id}, conditionId='{self.conditionId}')>"
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
 from database.models.KalshiEvent import KalshiEvent
 from database.models.PolyMarketEvent import PolyMarketEvent
-from database.models.MappingEvent import MappingEvent
\ No newline at end of file
+from database.models.MappingEvent import MappingEvent
+from database.models.ChangeLog import ChangeLog
\ No newline at end of file
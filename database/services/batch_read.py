@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.services.database import Database
+
+
+ReadCall = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def read(func: Callable[..., Awaitable[Any]], *args, **kwargs) -> ReadCall:
+    """
+    Откладывает вызов функции чтения репозитория: сессия подставится первым аргументом.
+
+    Пример:
+        read(get_kalshi_event_by_ticker, "KXBTC-25")
+    """
+    return lambda session: func(session, *args, **kwargs)
+
+
+async def _run_in_own_session(database: Database, call: ReadCall, semaphore: Optional[asyncio.Semaphore]) -> Any:
+    if semaphore is None:
+        async with database.session() as session:
+            return await call(session)
+    async with semaphore:
+        async with database.session() as session:
+            return await call(session)
+
+
+async def batch_read(
+        database: Database,
+        *calls: ReadCall,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False
+) -> List[Any]:
+    """
+    Выполняет независимые чтения одновременно и возвращает результаты в порядке вызовов.
+
+    AsyncSession нельзя использовать из нескольких корутин сразу, а asyncpg
+    не конвейеризует разные запросы на одном соединении, поэтому каждое
+    чтение получает свою сессию из пула. Время ответа близко к самому
+    медленному запросу, а не к сумме round trip'ов.
+
+    Для SQLite чтения выполняются последовательно в одной сессии:
+    соединение локальное, а in-memory база живет в единственном соединении.
+
+    :param
+        database: Экземпляр Database, из пула которого берутся соединения
+        calls: Функции session -> awaitable (см. read)
+        max_concurrency: Ограничение одновременно занятых соединений
+        return_exceptions: Вернуть исключения на местах результатов, а не пробросить первое
+
+    Пример:
+        event, market, mapping = await batch_read(
+            db,
+            read(get_kalshi_event_by_ticker, event_ticker),
+            read(get_poly_market_event, condition_id),
+            read(get_mapping_by_ids, kalshi_id, polymarket_id),
+        )
+    """
+    if database.dialect_name == 'sqlite':
+        results = []
+        async with database.session() as session:
+            for call in calls:
+                try:
+                    results.append(await call(session))
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+        return results
+
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    return list(await asyncio.gather(
+        *(_run_in_own_session(database, call, semaphore) for call in calls),
+        return_exceptions=return_exceptions,
+    ))
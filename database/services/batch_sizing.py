@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.services.statement_cache import column_keys
+
+
+# Лимит bind-параметров одного запроса в протоколе PostgreSQL (asyncpg)
+MAX_BIND_PARAMS = 32767
+
+# lock_not_available, query_canceled (statement_timeout), deadlock, serialization failure
+_RETRYABLE_SQLSTATES = {'55P03', '57014', '40P01', '40001'}
+
+
+def max_safe_batch_size(model) -> int:
+    """Максимум строк многострочного INSERT модели, укладывающийся в лимит параметров"""
+    return max(1, MAX_BIND_PARAMS // len(column_keys(model)))
+
+
+def is_contention_error(error: BaseException) -> bool:
+    """Таймаут или ожидание блокировки, после которых пакет стоит уменьшить"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    orig = getattr(error, 'orig', error)
+    if getattr(orig, 'sqlstate', None) in _RETRYABLE_SQLSTATES:
+        return True
+    # SQLite сообщает о блокировке только текстом
+    return 'database is locked' in str(error)
+
+
+class AdaptiveBatchSizer:
+    """
+    Подбирает размер пакета bulk-записи по измеренной задержке.
+
+    Размер не превышает max_safe_batch_size модели. После каждого пакета
+    оценивается время на строку (EWMA), и следующий пакет выбирается так,
+    чтобы его запись заняла около target_latency секунд; за один шаг размер
+    меняется не более чем в max_step раз. Таймауты и ожидания блокировок
+    уменьшают размер в shrink_factor раз.
+    """
+
+    def __init__(
+            self,
+            model,
+            target_latency: float = 0.5,
+            initial_size: int = 100,
+            min_size: int = 10,
+            max_step: float = 2.0,
+            shrink_factor: float = 0.5,
+            smoothing: float = 0.3
+    ):
+        self.model = model
+        self.target_latency = target_latency
+        self.max_size = max_safe_batch_size(model)
+        self.min_size = min(min_size, self.max_size)
+        self.max_step = max_step
+        self.shrink_factor = shrink_factor
+        self.smoothing = smoothing
+        self.batch_size = self._clamp(initial_size)
+
+        self.batches = 0
+        self.rows = 0
+        self.elapsed = 0.0
+        self.shrinks = 0
+        self.retries = 0
+        self.last_latency = None
+        self._row_latency = None
+        self.sizes: Deque[int] = deque(maxlen=20)
+
+    def _clamp(self, size: float) -> int:
+        return int(min(self.max_size, max(self.min_size, size)))
+
+    def record(self, rows: int, elapsed: float) -> int:
+        """Учитывает успешно записанный пакет и возвращает следующий размер"""
+        self.batches += 1
+        self.rows += rows
+        self.elapsed += elapsed
+        self.last_latency = elapsed
+        self.sizes.append(rows)
+        if rows <= 0:
+            return self.batch_size
+
+        row_latency = elapsed / rows
+        if self._row_latency is None:
+            self._row_latency = row_latency
+        else:
+            self._row_latency += self.smoothing * (row_latency - self._row_latency)
+
+        if self._row_latency > 0:
+            desired = self.target_latency / self._row_latency
+            desired = min(desired, self.batch_size * self.max_step)
+            desired = max(desired, self.batch_size / self.max_step)
+        else:
+            desired = self.batch_size * self.max_step
+        self.batch_size = self._clamp(desired)
+        return self.batch_size
+
+    def record_failure(self, error: BaseException) -> int:
+        """Уменьшает размер пакета после таймаута или ожидания блокировки"""
+        if is_contention_error(error):
+            self.shrinks += 1
+            self.batch_size = self._clamp(self.batch_size * self.shrink_factor)
+            logging.warning(
+                f"{self.model.__name__} batch hit contention ({error.__class__.__name__}), "
+                f"batch size reduced to {self.batch_size}"
+            )
+        return self.batch_size
+
+    @contextmanager
+    def timed(self, rows: int) -> Iterator[None]:
+        """Замеряет запись пакета: record при успехе, record_failure при исключении"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        self.record(rows, time.perf_counter() - started)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'model': self.model.__name__,
+            'batch_size': self.batch_size,
+            'max_size': self.max_size,
+            'batches': self.batches,
+            'rows': self.rows,
+            'rows_per_second': self.rows / self.elapsed if self.elapsed else 0.0,
+            'last_latency': self.last_latency,
+            'avg_batch_size': self.rows / self.batches if self.batches else 0.0,
+            'shrinks': self.shrinks,
+            'retries': self.retries,
+            'recent_sizes': list(self.sizes),
+        }
+
+
+async def write_in_batches(
+        session: AsyncSession,
+        rows: List,
+        write: Callable[[List], Awaitable[Any]],
+        batch_size: int,
+        max_size: int,
+        sizer: Optional[AdaptiveBatchSizer] = None
+) -> None:
+    """
+    Передает rows в write пакетами в рамках текущей транзакции сессии.
+
+    Без sizer размер пакета постоянный: batch_size, но не больше max_size.
+    С sizer размер берется из него, а каждый пакет пишется в SAVEPOINT:
+    пакет, упершийся в таймаут или ожидание блокировки, откатывается до
+    savepoint и повторяется уже уменьшенного размера. Когда уменьшать
+    некуда (min_size), ошибка пробрасывается вызывающему.
+    """
+    i = 0
+    while i < len(rows):
+        size = min(sizer.batch_size if sizer else batch_size, max_size)
+        batch = rows[i:i + size]
+        if sizer is None:
+            await write(batch)
+        else:
+            try:
+                async with session.begin_nested():
+                    with sizer.timed(len(batch)):
+                        await write(batch)
+            except Exception as e:
+                if not (is_contention_error(e) and sizer.batch_size < size):
+                    raise
+                sizer.retries += 1
+                logging.warning(
+                    f"Retrying {len(batch)} {sizer.model.__name__} rows in batches of {sizer.batch_size}"
+                )
+                continue
+        i += size
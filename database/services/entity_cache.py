@@ -0,0 +1,183 @@
+import asyncio
+import time
+from collections import OrderedDict, namedtuple
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import inspect
+
+
+_snapshot_types: Dict[type, type] = {}
+
+
+def snapshot(obj) -> Optional[tuple]:
+    """
+    Неизменяемый снимок ORM-объекта: namedtuple со значениями всех колонок.
+
+    Снимок не связан с сессией, поэтому его безопасно отдавать нескольким
+    корутинам и хранить в кеше после закрытия сессии.
+    """
+    if obj is None:
+        return None
+    model = type(obj)
+    snapshot_type = _snapshot_types.get(model)
+    if snapshot_type is None:
+        keys = [column.key for column in inspect(model).column_attrs]
+        snapshot_type = namedtuple(f"{model.__name__}Snapshot", keys)
+        _snapshot_types[model] = snapshot_type
+    return snapshot_type(*(getattr(obj, key) for key in snapshot_type._fields))
+
+
+class _LoadAbandoned(Exception):
+    """Загружавшая корутина отменена, ожидающие должны повторить попытку"""
+
+
+class EntityCache:
+    """
+    LRU-кеш с TTL для получения сущностей по ключу.
+
+    Одновременные промахи по одному ключу объединяются: запрос к БД
+    выполняет только первая корутина, остальные ждут ее результат.
+    Если первую корутину отменили, загрузку своим loader (и своей сессией)
+    продолжает одна из ожидающих. Если ключ инвалидирован, пока запрос
+    выполнялся, результат отдается ожидающим, но в кеш не попадает.
+    Результат None не кешируется.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple[str, Hashable], Tuple[float, tuple]]' = OrderedDict()
+        self._keys_by_id: Dict[Tuple[str, Any], Hashable] = {}
+        self._inflight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._versions: Dict[Tuple[str, Hashable], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, cache_key) -> Optional[tuple]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._drop(cache_key)
+            return None
+        self._entries.move_to_end(cache_key)
+        return value
+
+    def _put(self, cache_key, value: tuple) -> None:
+        self._entries[cache_key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(cache_key)
+        entity_id = getattr(value, 'id', None)
+        if entity_id is not None:
+            self._keys_by_id[(cache_key[0], entity_id)] = cache_key[1]
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, cache_key) -> None:
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            entity_id = getattr(entry[1], 'id', None)
+            self._keys_by_id.pop((cache_key[0], entity_id), None)
+
+    async def get_or_load(
+            self,
+            model: type,
+            key: Hashable,
+            loader: Callable[[], Awaitable[Any]]
+    ) -> Optional[tuple]:
+        """
+        Возвращает снимок сущности из кеша или загружает ее через loader.
+
+        :param
+            model: Класс модели (используется как пространство имен ключей)
+            key: Ключ поиска (тикер, conditionId и т.п.)
+            loader: Корутина без аргументов, возвращающая ORM-объект или None
+
+        :return
+            Снимок сущности (см. snapshot) или None
+        """
+        cache_key = (model.__name__, key)
+        while True:
+            value = self._get(cache_key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            inflight = self._inflight.get(cache_key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _LoadAbandoned:
+                # Загружавшую корутину отменили: загрузку начнет первая из ожидающих
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        version = self._versions.get(cache_key, 0)
+        try:
+            value = snapshot(await loader())
+        except asyncio.CancelledError:
+            # Отмена касается только этой корутины, ожидающие повторят загрузку
+            future.set_exception(_LoadAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано вызывающему, ожидающие получат его из future
+            future.exception()
+            raise
+        else:
+            if value is not None and self._versions.get(cache_key, 0) == version:
+                self._put(cache_key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(cache_key, None)
+            self._versions.pop(cache_key, None)
+
+    def invalidate(self, model: type, key: Hashable) -> None:
+        """Удаляет ключ из кеша и отменяет сохранение результата выполняющегося запроса"""
+        self._invalidate((model.__name__, key))
+
+    def _invalidate(self, cache_key) -> None:
+        # Версия нужна только ключам с запросом в полете
+        if cache_key in self._inflight:
+            self._versions[cache_key] = self._versions.get(cache_key, 0) + 1
+        self._drop(cache_key)
+
+    def invalidate_id(self, model: type, entity_id: Any) -> None:
+        """
+        Инвалидирует ключ, под которым закеширована сущность с данным id.
+
+        Ключ загрузки в полете еще неизвестен (id появится только в ее
+        результате), поэтому результаты всех загрузок этой модели в полете
+        не сохраняются в кеш - любая из них могла прочитать старую версию.
+        """
+        key = self._keys_by_id.get((model.__name__, entity_id))
+        if key is not None:
+            self.invalidate(model, key)
+        for cache_key in self._inflight:
+            if cache_key[0] == model.__name__:
+                self._versions[cache_key] = self._versions.get(cache_key, 0) + 1
+
+    def clear(self) -> None:
+        for cache_key in list(self._entries):
+            self._invalidate(cache_key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
+
+
+entity_cache = EntityCache()
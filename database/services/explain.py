@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.sql import Executable
+
+from database.CRUDs.KalshiEvent_repository import get_kalshi_event_by_ticker
+from database.CRUDs.MappingEvent_repository import (
+    get_mapping_by_ids, get_mapping_by_kalshi_id, get_mapping_by_polymarket_id,
+    get_related_kalshi_events, get_related_polymarket_events
+)
+from database.CRUDs.PolyMarketEvent_repository import get_poly_market_event
+from database.models import KalshiEvent, PolyMarketEvent
+
+
+INDEX_NODE_TYPES = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+# Функция чтения репозитория: session -> awaitable
+ReadCall = Callable[[AsyncSession], Awaitable[Any]]
+Query = Union[Executable, ReadCall]
+
+
+class IndexCheck(NamedTuple):
+    name: str
+    uses_index: bool
+    indexes: List[str]
+    seq_scans: List[str]
+    plan: Dict[str, Any]
+
+
+def repository_queries() -> Dict[str, Query]:
+    """
+    Проверяемые запросы.
+
+    Функции чтения репозиториев вызываются с примерными аргументами, и
+    проверяются те SQL, которые они действительно отправляют (lambda_stmt,
+    joinedload и т.д.), а не их копии. Остальное - типичные фильтры, под
+    которые объявлены индексы.
+    """
+    return {
+        'get_kalshi_event_by_ticker': lambda session: get_kalshi_event_by_ticker(session, 'EVENT'),
+        'kalshi_by_series': select(KalshiEvent).where(KalshiEvent.series_ticker == 'SERIES'),
+        'kalshi_by_status': select(KalshiEvent).where(KalshiEvent.status == 'settled'),
+        'kalshi_open_by_series': select(KalshiEvent).where(
+            KalshiEvent.status.in_(['open', 'active']),
+            KalshiEvent.series_ticker == 'SERIES'
+        ),
+        'get_poly_market_event': lambda session: get_poly_market_event(session, '0x0'),
+        'polymarket_by_slug': select(PolyMarketEvent).where(PolyMarketEvent.slug == 'slug'),
+        'polymarket_active_open': select(PolyMarketEvent.conditionId).where(
+            PolyMarketEvent.active,
+            ~PolyMarketEvent.closed,
+            PolyMarketEvent.acceptingOrders
+        ),
+        'get_mapping_by_ids': lambda session: get_mapping_by_ids(session, 1, 1),
+        'get_mapping_by_kalshi_id': lambda session: get_mapping_by_kalshi_id(session, 1),
+        'get_mapping_by_polymarket_id': lambda session: get_mapping_by_polymarket_id(session, 1),
+        'get_related_kalshi_events': lambda session: get_related_kalshi_events(session, 1),
+        'get_related_polymarket_events': lambda session: get_related_polymarket_events(session, 1),
+    }
+
+
+def _walk(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk(child)
+
+
+def _first_plan(plan: Any) -> Dict[str, Any]:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+async def explain(conn: Union[AsyncConnection, AsyncSession], stmt: Executable) -> Dict[str, Any]:
+    """Возвращает план запроса PostgreSQL (EXPLAIN FORMAT JSON) без его выполнения"""
+    dialect = conn.dialect if isinstance(conn, AsyncConnection) else conn.get_bind().dialect
+    compiled = stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+    result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+    return _first_plan(result.scalar_one())
+
+
+async def _captured_statements(conn: AsyncConnection, call: ReadCall) -> List[Tuple[str, Sequence]]:
+    """Выполняет функцию чтения в сессии поверх conn и возвращает отправленные ею SQL с параметрами"""
+    statements = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(conn.sync_connection, 'before_cursor_execute', capture)
+    try:
+        # Сессия работает внутри транзакции conn и не фиксирует ее
+        async with AsyncSession(bind=conn) as session:
+            await call(session)
+    finally:
+        event.remove(conn.sync_connection, 'before_cursor_execute', capture)
+    return statements
+
+
+def _index_check(name: str, plan: Dict[str, Any]) -> IndexCheck:
+    nodes = list(_walk(plan))
+    indexes = [n['Index Name'] for n in nodes if n.get('Node Type') in INDEX_NODE_TYPES]
+    seq_scans = [n.get('Relation Name', '') for n in nodes if n.get('Node Type') == 'Seq Scan']
+    if seq_scans:
+        logging.warning(f"Query {name} uses seq scan on {', '.join(seq_scans)}")
+    return IndexCheck(name, bool(indexes) and not seq_scans, indexes, seq_scans, plan)
+
+
+async def check_index_usage(
+        engine: AsyncEngine,
+        queries: Optional[Dict[str, Query]] = None,
+        assume_large_tables: bool = False
+) -> List[IndexCheck]:
+    """
+    Проверяет, что запросы используют индексы.
+
+    Проверка идет в отдельном соединении и транзакции, которая в конце
+    откатывается, поэтому сессии приложения не затрагиваются. Функции
+    чтения репозиториев выполняются, и для каждого отправленного ими SELECT
+    строится план с теми же параметрами.
+
+    Планировщик выбирает seq scan для маленьких таблиц, поэтому на
+    dev-базе результат отражает реальный размер таблиц. Чтобы проверить
+    саму возможность использовать индекс, передайте assume_large_tables=True:
+    тогда в транзакции выполняется SET LOCAL enable_seqscan = off и seq scan
+    остается в плане только если подходящего индекса нет.
+
+    :param
+        engine: AsyncEngine (PostgreSQL)
+        queries: Словарь имя -> запрос или функция чтения (по умолчанию repository_queries())
+        assume_large_tables: Запрещать планировщику seq scan
+
+    :return
+        Список IndexCheck по каждому запросу
+    """
+    queries = queries or repository_queries()
+    checks = []
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            if assume_large_tables:
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+
+            for name, query in queries.items():
+                if isinstance(query, Executable):
+                    checks.append(_index_check(name, await explain(conn, query)))
+                    continue
+
+                statements = await _captured_statements(conn, query)
+                if not statements:
+                    logging.warning(f"Query {name} sent no SELECT statements")
+                for number, (statement, parameters) in enumerate(statements):
+                    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+                    label = name if len(statements) == 1 else f"{name}[{number}]"
+                    checks.append(_index_check(label, _first_plan(result.scalar_one())))
+        finally:
+            # Откатываем SET LOCAL вместе с транзакцией
+            await transaction.rollback()
+    return checks
+
+
+if __name__ == '__main__':
+    from database.services.database import db
+
+    async def main():
+        try:
+            for check in await check_index_usage(db.engine, assume_large_tables=True):
+                status = 'OK ' if check.uses_index else 'SEQ'
+                print(f"{status} {check.name}: {', '.join(check.indexes or check.seq_scans)}")
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import KalshiEvent, PolyMarketEvent, MappingEvent
+
+
+# Таблицы, доступные для экспорта
+EXPORT_MODELS = {
+    model.__tablename__: model
+    for model in (KalshiEvent, PolyMarketEvent, MappingEvent)
+}
+
+# Колонки, которые хранятся строками, но по смыслу являются временем (ISO 8601)
+STRING_TIMESTAMP_COLUMNS = {
+    'kalshi_events': {
+        'open_time',
+        'close_time',
+        'expected_expiration_time',
+        'expiration_time',
+        'latest_expiration_time',
+    },
+    'polymarket_events': {
+        'startDate',
+        'endDate',
+        'clobRewardsEndDate',
+    },
+}
+
+WATERMARK_FILE = '_watermark.json'
+
+# Перекрытие для временного watermark: транзакция может закоммитить строку
+# с updated_at меньше уже сохраненного watermark
+DEFAULT_WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+@dataclass
+class ExportResult:
+    """Итог экспорта одной таблицы"""
+    table: str
+    rows: int = 0
+    files: List[str] = field(default_factory=list)
+    watermark: Any = None
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Для экспорта требуется pyarrow: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Приводит ISO-строку к naive datetime в UTC, некорректные значения -> None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def arrow_schema(model):
+    """
+    Строит Arrow-схему по колонкам модели.
+
+    Boolean -> bool, Float -> float64, Integer -> int64, Date -> date32,
+    DateTime и строковые ISO-времена -> timestamp[us, UTC], остальное -> string.
+    """
+    pa, _ = _require_pyarrow()
+    string_timestamps = STRING_TIMESTAMP_COLUMNS.get(model.__tablename__, set())
+
+    fields = []
+    for column in model.__table__.columns:
+        col_type = column.type
+        if column.key in string_timestamps or isinstance(col_type, sqlalchemy.DateTime):
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif isinstance(col_type, sqlalchemy.Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(col_type, sqlalchemy.Float):
+            arrow_type = pa.float64()
+        elif isinstance(col_type, sqlalchemy.Integer):
+            arrow_type = pa.int64()
+        elif isinstance(col_type, sqlalchemy.Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.key, arrow_type, nullable=True))
+    return pa.schema(fields)
+
+
+def rows_to_record_batch(model, schema, rows: Sequence[Sequence[Any]]):
+    """Преобразует порцию строк (в порядке колонок модели) в Arrow RecordBatch"""
+    pa, _ = _require_pyarrow()
+    string_timestamps = STRING_TIMESTAMP_COLUMNS.get(model.__tablename__, set())
+
+    arrays = []
+    for index, arrow_field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if arrow_field.name in string_timestamps or pa.types.is_timestamp(arrow_field.type):
+            values = [_parse_timestamp(v) for v in values]
+        arrays.append(pa.array(values, type=arrow_field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def read_watermark(table_dir: str) -> Optional[Dict[str, Any]]:
+    """Читает сохраненный watermark предыдущего экспорта (время - datetime)"""
+    path = os.path.join(table_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        watermark = json.load(f)
+    if watermark.get('type') == 'datetime':
+        watermark['value'] = datetime.fromisoformat(watermark['value'])
+    return watermark
+
+
+def _write_watermark(table_dir: str, column: str, value: Any) -> None:
+    path = os.path.join(table_dir, WATERMARK_FILE)
+    tmp_path = f"{path}.tmp"
+    watermark = {'column': column, 'value': value}
+    if isinstance(value, datetime):
+        watermark.update(value=value.isoformat(), type='datetime')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, path)
+
+
+async def export_table(
+        session: AsyncSession,
+        table: str,
+        output_dir: str,
+        chunk_size: int = 50_000,
+        incremental: bool = False,
+        watermark_column: str = 'updated_at',
+        compression: str = 'zstd',
+        overlap: timedelta = DEFAULT_WATERMARK_OVERLAP
+) -> ExportResult:
+    """
+    Потоково выгружает таблицу в партиционированные Parquet-файлы.
+
+    Строки читаются серверным курсором порциями по chunk_size, каждая порция
+    превращается в RecordBatch и сразу пишется в отдельный файл
+    ``<output_dir>/<table>/export_ts=<время>/part-<n>.parquet``, поэтому
+    потребление памяти ограничено размером порции.
+
+    :param
+        session: Асинхронная сессия SQLAlchemy
+        table: Имя таблицы (ключ EXPORT_MODELS)
+        output_dir: Каталог для выгрузки
+        chunk_size: Количество строк в одной порции/файле
+        incremental: Выгружать только строки, вставленные или измененные
+            после прошлого экспорта (watermark_column больше сохраненного)
+        watermark_column: Колонка watermark: updated_at (по умолчанию) или
+            другая растущая колонка, например source_seq
+        compression: Кодек сжатия Parquet
+        overlap: Для временного watermark повторно выгружаются строки за
+            этот интервал до него, чтобы не пропустить поздние коммиты.
+            Перекрывающиеся строки дублируются между выгрузками, читателю
+            следует брать последнюю версию строки по id
+
+    :return
+        ExportResult с количеством строк, списком файлов и новым watermark
+    """
+    pa, pq = _require_pyarrow()
+
+    model = EXPORT_MODELS.get(table)
+    if model is None:
+        raise ValueError(f"Unknown table '{table}'. Available: {', '.join(EXPORT_MODELS)}")
+
+    columns = list(model.__table__.columns)
+    column_keys = [column.key for column in columns]
+    if watermark_column not in column_keys:
+        raise ValueError(f"Column '{watermark_column}' not found in table '{table}'")
+    watermark_index = column_keys.index(watermark_column)
+    watermark_attr = model.__table__.columns[watermark_column]
+
+    table_dir = os.path.join(output_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+
+    result = ExportResult(table=table)
+    previous = read_watermark(table_dir) if incremental else None
+    if previous is not None and previous.get('column') == watermark_column:
+        result.watermark = previous.get('value')
+
+    stmt = select(*columns).order_by(watermark_attr, model.__table__.c.id)
+    if result.watermark is not None:
+        since = result.watermark
+        if isinstance(since, datetime):
+            since -= overlap
+        stmt = stmt.where(watermark_attr > since)
+    stmt = stmt.execution_options(yield_per=chunk_size)
+
+    schema = arrow_schema(model)
+    run_dir = os.path.join(
+        table_dir,
+        f"export_ts={datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}"
+    )
+
+    stream = await session.stream(stmt)
+    async for rows in stream.partitions(chunk_size):
+        if not rows:
+            continue
+        os.makedirs(run_dir, exist_ok=True)
+        batch = rows_to_record_batch(model, schema, rows)
+        path = os.path.join(run_dir, f"part-{len(result.files):05d}.parquet")
+        pq.write_table(pa.Table.from_batches([batch]), path, compression=compression)
+        result.files.append(path)
+        result.rows += len(rows)
+        values = [row[watermark_index] for row in rows if row[watermark_index] is not None]
+        if values:
+            latest = max(values)
+            if result.watermark is None or latest > result.watermark:
+                result.watermark = latest
+        logging.debug(f"Exported {len(rows)} rows of {table} to {path}")
+
+    if result.rows:
+        _write_watermark(table_dir, watermark_column, result.watermark)
+    logging.info(f"Export of {table} finished: {result.rows} rows, {len(result.files)} files")
+    return result
+
+
+async def export_all_tables(
+        session: AsyncSession,
+        output_dir: str,
+        chunk_size: int = 50_000,
+        incremental: bool = False
+) -> Dict[str, ExportResult]:
+    """Выгружает все таблицы EXPORT_MODELS, возвращает результаты по имени таблицы"""
+    results = {}
+    for table in EXPORT_MODELS:
+        results[table] = await export_table(
+            session,
+            table,
+            output_dir,
+            chunk_size=chunk_size,
+            incremental=incremental
+        )
+    return results
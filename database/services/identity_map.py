@@ -0,0 +1,89 @@
+import sys
+from collections import Counter
+from typing import Any, Dict, Union
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+EVICTED_KEY = 'identity_map_evicted'
+
+
+def _sync_session(session: Union[AsyncSession, Session]) -> Session:
+    return getattr(session, 'sync_session', session)
+
+
+def _approx_size(obj) -> int:
+    """Неглубокий размер объекта: сам объект, его __dict__ и значения атрибутов"""
+    state = getattr(obj, '__dict__', {})
+    return (
+        sys.getsizeof(obj)
+        + sys.getsizeof(state)
+        + sum(sys.getsizeof(value) for key, value in state.items() if key != '_sa_instance_state')
+    )
+
+
+def identity_map_metrics(session: Union[AsyncSession, Session]) -> Dict[str, Any]:
+    """
+    Метрики identity map сессии.
+
+    :return
+        size: количество объектов в identity map
+        by_class: количество объектов по моделям
+        pending: новые объекты, еще не записанные flush
+        approx_bytes: приблизительная память объектов (без учета общих строк)
+        evicted: сколько объектов вытеснено ограничением размера
+    """
+    sync_session = _sync_session(session)
+    objects = list(sync_session.identity_map.values())
+    return {
+        'size': len(objects),
+        'by_class': dict(Counter(type(obj).__name__ for obj in objects)),
+        'pending': len(sync_session.new),
+        'approx_bytes': sum(_approx_size(obj) for obj in objects),
+        'evicted': sync_session.info.get(EVICTED_KEY, 0),
+    }
+
+
+def trim_identity_map(session: Union[AsyncSession, Session], max_size: int) -> int:
+    """
+    Удаляет из сессии чистые persistent-объекты, пока identity map больше max_size.
+
+    Вытесняются сначала самые старые объекты. Измененные и удаляемые объекты
+    не трогаются, чтобы не потерять незаписанные изменения.
+
+    :return
+        Количество вытесненных объектов
+    """
+    sync_session = _sync_session(session)
+    excess = len(sync_session.identity_map) - max_size
+    if excess <= 0:
+        return 0
+
+    modified = sync_session.dirty | sync_session.deleted
+    evicted = 0
+    for obj in list(sync_session.identity_map.values()):
+        if evicted >= excess:
+            break
+        if obj in modified:
+            continue
+        sync_session.expunge(obj)
+        evicted += 1
+
+    sync_session.info[EVICTED_KEY] = sync_session.info.get(EVICTED_KEY, 0) + evicted
+    return evicted
+
+
+def bound_identity_map(session: Union[AsyncSession, Session], max_size: int) -> None:
+    """
+    Ограничивает identity map сессии: после каждого flush и commit
+    лишние чистые объекты вытесняются (см. trim_identity_map).
+    """
+    sync_session = _sync_session(session)
+
+    def _trim(target_session, *_):
+        trim_identity_map(target_session, max_size)
+
+    event.listen(sync_session, 'after_flush_postexec', _trim)
+    event.listen(sync_session, 'after_commit', _trim)
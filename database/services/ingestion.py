@@ -0,0 +1,278 @@
+import codecs
+import inspect
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.CRUDs.conditional_writes import WriteResult
+
+
+Rows = Union[Iterable[Dict], AsyncIterable[Dict]]
+# create_*_bulk возвращают bool, upsert_* - WriteResult
+BulkWriter = Callable[..., Awaitable[Union[bool, WriteResult]]]
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = set('+-0123456789.eE')
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+@dataclass
+class BatchError:
+    """Ошибка записи одного пакета"""
+    batch: int
+    first_row: int
+    size: int
+    error: str
+
+
+@dataclass
+class IngestReport:
+    """Итог потоковой загрузки"""
+    rows: int = 0
+    written_rows: int = 0
+    stale_rows: int = 0
+    batches: int = 0
+    errors: List[BatchError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+async def _read_chunks(source, chunk_size: int) -> AsyncIterator[Union[str, bytes]]:
+    """Читает файл (sync/async read) или итерируемый поток чанков (bytes/str)"""
+    read = getattr(source, 'read', None)
+    if read is not None:
+        while True:
+            chunk = read(chunk_size)
+            if inspect.isawaitable(chunk):
+                chunk = await chunk
+            if not chunk:
+                return
+            yield chunk
+    elif hasattr(source, '__aiter__'):
+        async for chunk in source:
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def _is_truncated(buffer: str, error: json.JSONDecodeError) -> bool:
+    """Ошибка разбора вызвана концом буфера (элемент дочитан не полностью), а не некорректным JSON"""
+    if error.pos >= len(buffer) or error.msg.startswith('Unterminated string'):
+        return True
+    # Обрезанная escape-последовательность (\uXXXX, суррогатная пара)
+    if 'escape' in error.msg and len(buffer) - error.pos < 12:
+        return True
+    tail = buffer[error.pos:]
+    return any(literal.startswith(tail) for literal in _LITERALS) or all(c in _NUMBER_CHARS for c in tail)
+
+
+async def iter_json_array(
+        source,
+        chunk_size: int = 1 << 16,
+        max_item_size: int = 64 << 20
+) -> AsyncIterator[Any]:
+    """
+    Инкрементально разбирает JSON-массив верхнего уровня и отдает элементы по одному.
+
+    В памяти держится только текущий непрочитанный хвост буфера, поэтому
+    многогигабайтный дамп разбирается с памятью порядка размера одного элемента.
+    Элемент принимается, только когда за ним виден разделитель (',' или ']'),
+    поэтому числа, разрезанные границей чанка, не разбираются раньше времени.
+    Некорректный JSON приводит к ValueError сразу, а не в конце файла.
+
+    :param
+        source: Файл (открытый в текстовом или бинарном режиме, с sync или async
+            методом read) либо sync/async итерируемый поток чанков bytes/str
+        chunk_size: Размер читаемого чанка
+        max_item_size: Максимальный размер одного элемента в символах;
+            ограничивает память на некорректном входе
+
+    Пример:
+        with open("markets.json", "rb") as f:
+            async for market in iter_json_array(f):
+                ...
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    # start: ждем '[', first: элемент или ']', item: элемент, separator: ',' или ']',
+    # done: массив закрыт, допустимы только пробелы до конца входа
+    state = 'start'
+    eof = False
+    chunks = _read_chunks(source, chunk_size)
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+
+        if position < len(buffer):
+            char = buffer[position]
+            if state == 'done':
+                raise ValueError(f"Unexpected data after JSON array at position {position}: {char!r}")
+            if state == 'start':
+                if char != '[':
+                    raise ValueError(f"Expected JSON array, got {char!r}")
+                state = 'first'
+                position += 1
+                continue
+            if state == 'separator':
+                if char == ']':
+                    state = 'done'
+                    position += 1
+                    continue
+                if char != ',':
+                    raise ValueError(f"Expected ',' or ']' at position {position}, got {char!r}")
+                state = 'item'
+                position += 1
+                continue
+            if char == ']' and state == 'first':
+                state = 'done'
+                position += 1
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof or not _is_truncated(buffer, e):
+                    raise ValueError(f"Malformed JSON array: {e}") from None
+            else:
+                # Элемент принимается, только если за ним виден разделитель
+                lookahead = end
+                while lookahead < len(buffer) and buffer[lookahead] in _WHITESPACE:
+                    lookahead += 1
+                if lookahead < len(buffer) and buffer[lookahead] in ',]':
+                    position = end
+                    state = 'separator'
+                    yield item
+                    continue
+                if eof and lookahead == len(buffer):
+                    raise ValueError("Unexpected end of JSON array")
+                if lookahead < len(buffer):
+                    # Допустимо только продолжение числа, обрезанного концом буфера
+                    run = end
+                    while run < len(buffer) and buffer[run] in _NUMBER_CHARS:
+                        run += 1
+                    if eof or run == end or run < len(buffer):
+                        raise ValueError(
+                            f"Expected ',' or ']' at position {lookahead}, got {buffer[lookahead]!r}"
+                        )
+
+            if len(buffer) - position > max_item_size:
+                raise ValueError(f"JSON array item at position {position} exceeds {max_item_size} characters")
+
+        elif eof:
+            if state == 'done':
+                return
+            raise ValueError("Unexpected end of JSON array")
+
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            eof = True
+            buffer = buffer[position:] + utf8.decode(b'', final=True)
+            position = 0
+            continue
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+async def aiter_batches(rows: Rows, batch_size: int) -> AsyncIterator[List[Dict]]:
+    """Разбивает sync или async итерируемый поток строк на списки по batch_size"""
+    batch = []
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    else:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def ingest_events(
+        session: AsyncSession,
+        rows: Rows,
+        writer: BulkWriter,
+        batch_size: int = 1000,
+        on_progress: Optional[Callable[[IngestReport], Any]] = None,
+        stop_on_error: bool = False,
+        **writer_kwargs
+) -> IngestReport:
+    """
+    Потоково записывает строки пакетами через bulk-функцию репозитория.
+
+    Каждый пакет приводится к типам и коммитится отдельно функцией writer
+    (create_*_bulk или upsert_*), после чего
+    объекты удаляются из сессии. Пиковая память пропорциональна batch_size,
+    а не размеру входа.
+
+    :param
+        session: Асинхронная сессия SQLAlchemy
+        rows: sync/async итерируемый поток словарей (например iter_json_array(f))
+        writer: Bulk-функция репозитория (session, events_data, **kwargs) -> bool | WriteResult
+        batch_size: Количество строк в одном пакете (передается writer, если
+            writer_kwargs не задает свой batch_size)
+        on_progress: Вызывается (sync или async) после каждого пакета с текущим отчетом
+        stop_on_error: Прекратить загрузку после первого неудачного пакета
+        writer_kwargs: Дополнительные аргументы writer (например cache)
+
+    :return
+        IngestReport с количеством строк и ошибками по пакетам
+    """
+    report = IngestReport()
+
+    async for batch in aiter_batches(rows, batch_size):
+        first_row = report.rows
+        report.rows += len(batch)
+        report.batches += 1
+
+        written = stale = 0
+        try:
+            result = await writer(session, batch, **{'batch_size': len(batch), **writer_kwargs})
+            if isinstance(result, WriteResult):
+                # upsert_*: строки с устаревшим source_seq пропущены, а не потеряны
+                written, stale, error = result.applied, result.stale, result.error
+            elif result:
+                written, error = len(batch), None
+            else:
+                error = "bulk writer rejected the batch, see log for details"
+        except Exception as e:
+            await session.rollback()
+            error = str(e)
+
+        if error is None:
+            report.written_rows += written
+            report.stale_rows += stale
+        else:
+            report.errors.append(BatchError(report.batches - 1, first_row, len(batch), error))
+            logging.warning(f"Ingestion batch {report.batches - 1} (rows {first_row}+{len(batch)}) failed: {error}")
+        session.expunge_all()
+
+        if on_progress is not None:
+            result = on_progress(report)
+            if inspect.isawaitable(result):
+                await result
+
+        if error is not None and stop_on_error:
+            break
+
+    logging.info(
+        f"Ingestion finished: {report.written_rows}/{report.rows} rows written, "
+        f"{report.stale_rows} stale, {len(report.errors)} failed batches"
+    )
+    return report
@@ -0,0 +1,220 @@
+import logging
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models.MappingEvent import MappingEvent
+
+
+# Формат файла (little-endian):
+#   заголовок  : magic(4s) version(H) reserved(H) count(I) max_id(I) blob_size(Q)
+#   записи     : count * (id, kalshi_ticker off/len, clobTokenId off/len, outcome off/len)
+#   blob       : UTF-8 строки, на которые ссылаются записи
+SNAPSHOT_MAGIC = b'MEVS'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIIQ')
+_RECORD = struct.Struct('<IIIIIII')
+
+
+class MappingRecord(NamedTuple):
+    id: int
+    kalshi_ticker: str
+    polymarket_clobTokenId: str
+    polymarket_outcome: str
+
+
+def write_mapping_snapshot(path: str, records: Iterable[MappingRecord]) -> int:
+    """
+    Атомарно записывает снапшот маппингов на диск.
+
+    Файл сначала пишется во временный, затем заменяет старый через os.replace,
+    поэтому читатели никогда не видят частично записанный снапшот.
+
+    :return
+        max_id записанных маппингов (0 если записей нет)
+    """
+    packed_records = []
+    blob = bytearray()
+    max_id = 0
+
+    for record in records:
+        offsets = []
+        for value in (record.kalshi_ticker, record.polymarket_clobTokenId, record.polymarket_outcome):
+            encoded = (value or '').encode('utf-8')
+            offsets.extend((len(blob), len(encoded)))
+            blob += encoded
+        packed_records.append(_RECORD.pack(record.id, *offsets))
+        max_id = max(max_id, record.id)
+
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(packed_records), max_id, len(blob)
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.writelines(packed_records)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    logging.debug(f"Mapping snapshot written to {path}: {len(packed_records)} records, max_id={max_id}")
+    return max_id
+
+
+class MappingSnapshot:
+    """
+    Снапшот маппингов, отображенный в память через mmap.
+
+    Загрузка не читает файл целиком: записи декодируются лениво при обращении,
+    поэтому старт воркера занимает миллисекунды независимо от размера снапшота.
+    Маппинги, полученные через catch_up, по умолчанию сразу сохраняются в файл.
+    """
+
+    def __init__(self, path: str, mapped: Optional[mmap.mmap], count: int, max_id: int):
+        self.path = path
+        self._mmap = mapped
+        self._count = count
+        self._records_offset = _HEADER.size
+        self._blob_offset = _HEADER.size + count * _RECORD.size
+        self._extra: List[MappingRecord] = []
+        self.max_id = max_id
+
+    @classmethod
+    def load(cls, path: str) -> Optional['MappingSnapshot']:
+        """Открывает снапшот, возвращает None если файла нет или формат не подходит"""
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                logging.warning(f"Mapping snapshot {path} is truncated")
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, count, max_id, blob_size = _HEADER.unpack_from(mapped, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logging.warning(f"Unsupported mapping snapshot {path}: magic={magic!r}, version={version}")
+            mapped.close()
+            return None
+        if len(mapped) != _HEADER.size + count * _RECORD.size + blob_size:
+            logging.warning(f"Mapping snapshot {path} has unexpected size")
+            mapped.close()
+            return None
+
+        return cls(path, mapped, count, max_id)
+
+    def __len__(self) -> int:
+        return self._count + len(self._extra)
+
+    def _decode(self, offset: int, length: int) -> str:
+        start = self._blob_offset + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def __iter__(self) -> Iterator[MappingRecord]:
+        for index in range(self._count):
+            record_id, kt_off, kt_len, clob_off, clob_len, out_off, out_len = _RECORD.unpack_from(
+                self._mmap, self._records_offset + index * _RECORD.size
+            )
+            yield MappingRecord(
+                record_id,
+                self._decode(kt_off, kt_len),
+                self._decode(clob_off, clob_len),
+                self._decode(out_off, out_len),
+            )
+        yield from self._extra
+
+    def kalshi_tickers(self) -> List[str]:
+        """Уникальные kalshi_ticker, аналог get_all_kalshi_tickers"""
+        return list(dict.fromkeys(record.kalshi_ticker for record in self))
+
+    def clob_token_ids(self) -> List[str]:
+        """Уникальные clobTokenId, аналог get_all_polymarket_clob_token_ids"""
+        return list(dict.fromkeys(record.polymarket_clobTokenId for record in self))
+
+    async def catch_up(self, session: AsyncSession, persist: bool = True) -> List[MappingRecord]:
+        """
+        Догружает маппинги с id больше max_id снапшота.
+
+        Удаленные и измененные маппинги так не обнаруживаются, для полной
+        сверки используйте sync_mapping_snapshot.
+
+        :param
+            session: Асинхронная сессия SQLAlchemy
+            persist: Сразу переписать файл (см. save), чтобы следующий
+                холодный старт не терял догруженные маппинги
+
+        :return
+            Список новых маппингов
+        """
+        new_records = await _fetch_mapping_records(session, after_id=self.max_id)
+        if new_records:
+            self._extra.extend(new_records)
+            self.max_id = new_records[-1].id
+            logging.debug(f"Mapping snapshot caught up {len(new_records)} records, max_id={self.max_id}")
+            if persist:
+                self.save()
+        return new_records
+
+    def save(self) -> None:
+        """Переписывает файл снапшота вместе с догруженными маппингами и открывает его заново"""
+        if not self._extra:
+            return
+        write_mapping_snapshot(self.path, list(self))
+        reloaded = MappingSnapshot.load(self.path)
+        if reloaded is None:
+            logging.error(f"Mapping snapshot {self.path} could not be reopened after save")
+            return
+        self.close()
+        self._mmap, self._count, self.max_id = reloaded._mmap, reloaded._count, reloaded.max_id
+        self._blob_offset = reloaded._blob_offset
+        self._extra = []
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+async def _fetch_mapping_records(session: AsyncSession, after_id: int = 0) -> List[MappingRecord]:
+    stmt = (
+        select(
+            MappingEvent.id,
+            MappingEvent.kalshi_ticker,
+            MappingEvent.polymarket_clobTokenId,
+            MappingEvent.polymarket_outcome,
+        )
+        .where(MappingEvent.id > after_id)
+        .order_by(MappingEvent.id)
+    )
+    result = await session.execute(stmt)
+    return [MappingRecord(*row) for row in result.all()]
+
+
+async def sync_mapping_snapshot(session: AsyncSession, path: str) -> Optional[MappingSnapshot]:
+    """
+    Полностью перечитывает mapping_events из БД и перезаписывает снапшот.
+
+    :param
+        session: Асинхронная сессия SQLAlchemy
+        path: Путь к файлу снапшота
+
+    :return
+        Загруженный новый снапшот или None в случае ошибки
+    """
+    try:
+        records = await _fetch_mapping_records(session)
+        write_mapping_snapshot(path, records)
+        logging.info(f"Mapping snapshot synced: {len(records)} records")
+        return MappingSnapshot.load(path)
+    except Exception as e:
+        logging.error(f"Error syncing mapping snapshot: {str(e)}")
+        return None
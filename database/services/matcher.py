@@ -0,0 +1,330 @@
+import heapq
+import json
+import logging
+import re
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.CRUDs.MappingEvent_repository import create_mapping_event
+from database.models import KalshiEvent, PolyMarketEvent, MappingEvent
+from database.services.export import DEFAULT_WATERMARK_OVERLAP
+
+
+# Из description Polymarket индексируется только начало: дальше обычно идут
+# однотипные правила разрешения рынка, которые лишь размывают оценку
+DESCRIPTION_PREFIX = 300
+
+_TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+class CandidatePair(NamedTuple):
+    kalshi_id: int
+    polymarket_id: int
+    score: float
+
+
+class _Document(NamedTuple):
+    trigrams: FrozenSet[str]
+    date: Optional[datetime]
+    categories: FrozenSet[str]
+
+
+def text_trigrams(text: str) -> FrozenSet[str]:
+    """Множество триграмм нормализованного текста (как в pg_trgm: слова дополняются пробелами)"""
+    trigrams: Set[str] = set()
+    for token in _TOKEN_RE.findall((text or '').lower()):
+        padded = f"  {token} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(trigrams)
+
+
+def _parse_date(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _parse_tags(value) -> FrozenSet[str]:
+    """tags Polymarket хранятся JSON-строкой: список строк или объектов с label/slug"""
+    if not value:
+        return frozenset()
+    try:
+        tags = json.loads(value)
+    except (TypeError, ValueError):
+        return frozenset()
+    labels = set()
+    for tag in tags if isinstance(tags, list) else []:
+        if isinstance(tag, dict):
+            tag = tag.get('label') or tag.get('slug')
+        if tag:
+            labels.add(str(tag).lower())
+    return frozenset(labels)
+
+
+class _TrigramIndex:
+    """Инвертированный индекс триграмма -> id документов"""
+
+    def __init__(self):
+        self.documents: Dict[int, _Document] = {}
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+
+    def add(self, doc_id: int, document: _Document) -> None:
+        self.remove(doc_id)
+        self.documents[doc_id] = document
+        for trigram in document.trigrams:
+            self.postings[trigram].add(doc_id)
+
+    def remove(self, doc_id: int) -> None:
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        for trigram in document.trigrams:
+            ids = self.postings.get(trigram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[trigram]
+
+    def overlaps(self, trigrams: Iterable[str], max_posting: int) -> Counter:
+        """Количество общих триграмм с каждым документом; слишком частые триграммы пропускаются"""
+        counts: Counter = Counter()
+        for trigram in trigrams:
+            ids = self.postings.get(trigram)
+            if ids and len(ids) <= max_posting:
+                counts.update(ids)
+        return counts
+
+
+class CandidateMatcher:
+    """
+    Генератор кандидатов в пары Kalshi <-> Polymarket.
+
+    Оба набора событий индексируются по триграммам текста (Kalshi: title,
+    sub_title, yes_sub_title; Polymarket: slug и начало description).
+    Для события ищутся только документы с общими триграммами, а не все
+    N x M пар. Пары дополнительно отсекаются по окну дат и по категориям,
+    если они известны с обеих сторон, и оцениваются коэффициентом Дайса.
+
+    Индекс обновляется инкрементально: load_from_db перечитывает только
+    события, измененные после прошлой загрузки (по updated_at).
+    """
+
+    def __init__(
+            self,
+            date_window: timedelta = timedelta(days=3),
+            min_score: float = 0.3,
+            max_posting: int = 5000,
+            overlap: timedelta = DEFAULT_WATERMARK_OVERLAP
+    ):
+        self.date_window = date_window
+        self.min_score = min_score
+        self.max_posting = max_posting
+        self.overlap = overlap
+        self.kalshi = _TrigramIndex()
+        self.polymarket = _TrigramIndex()
+        # Уже связанные пары в обе стороны: kalshi_id -> {polymarket_id} и наоборот
+        self.mapped_polymarket: Dict[int, Set[int]] = defaultdict(set)
+        self.mapped_kalshi: Dict[int, Set[int]] = defaultdict(set)
+        # Максимальный updated_at загруженных событий (None - еще не загружались)
+        self.kalshi_watermark: Optional[Any] = None
+        self.polymarket_watermark: Optional[Any] = None
+
+    @staticmethod
+    def kalshi_document(title, sub_title, yes_sub_title, close_time, category) -> _Document:
+        text = ' '.join(filter(None, (title, sub_title, yes_sub_title)))
+        return _Document(
+            text_trigrams(text),
+            _parse_date(close_time),
+            frozenset({category.lower()}) if category else frozenset(),
+        )
+
+    @staticmethod
+    def polymarket_document(slug, description, end_date, tags) -> _Document:
+        text = ' '.join(filter(None, ((slug or '').replace('-', ' '), (description or '')[:DESCRIPTION_PREFIX])))
+        return _Document(text_trigrams(text), _parse_date(end_date), _parse_tags(tags))
+
+    def add_kalshi_event(self, event: KalshiEvent) -> None:
+        self.kalshi.add(event.id, self.kalshi_document(
+            event.title, event.sub_title, event.yes_sub_title, event.close_time, event.category
+        ))
+
+    def add_polymarket_event(self, event: PolyMarketEvent) -> None:
+        self.polymarket.add(event.id, self.polymarket_document(
+            event.slug, event.description, event.endDate, event.tags
+        ))
+
+    def _mark_mapped(self, kalshi_id: int, polymarket_id: int) -> None:
+        self.mapped_polymarket[kalshi_id].add(polymarket_id)
+        self.mapped_kalshi[polymarket_id].add(kalshi_id)
+
+    def _compatible(self, a: _Document, b: _Document) -> bool:
+        if a.date and b.date and abs(a.date - b.date) > self.date_window:
+            return False
+        if a.categories and b.categories and not (a.categories & b.categories):
+            return False
+        return True
+
+    def _top_k(self, document: _Document, index: _TrigramIndex, k: int):
+        scored = []
+        for doc_id, overlap in index.overlaps(document.trigrams, self.max_posting).items():
+            other = index.documents[doc_id]
+            score = 2 * overlap / (len(document.trigrams) + len(other.trigrams))
+            if score >= self.min_score and self._compatible(document, other):
+                scored.append((score, doc_id))
+        return heapq.nlargest(k, scored)
+
+    def candidates_for_kalshi(self, kalshi_id: int, k: int = 5) -> List[CandidatePair]:
+        """Top-k событий Polymarket для события Kalshi, без уже связанных пар"""
+        document = self.kalshi.documents.get(kalshi_id)
+        if document is None:
+            return []
+        mapped = self.mapped_polymarket.get(kalshi_id, set())
+        return [
+            CandidatePair(kalshi_id, polymarket_id, score)
+            for score, polymarket_id in self._top_k(document, self.polymarket, k + len(mapped))
+            if polymarket_id not in mapped
+        ][:k]
+
+    def candidates_for_polymarket(self, polymarket_id: int, k: int = 5) -> List[CandidatePair]:
+        """Top-k событий Kalshi для события Polymarket, без уже связанных пар"""
+        document = self.polymarket.documents.get(polymarket_id)
+        if document is None:
+            return []
+        mapped = self.mapped_kalshi.get(polymarket_id, set())
+        return [
+            CandidatePair(kalshi_id, polymarket_id, score)
+            for score, kalshi_id in self._top_k(document, self.kalshi, k + len(mapped))
+            if kalshi_id not in mapped
+        ][:k]
+
+    def all_candidates(self, k: int = 5, kalshi_ids: Optional[Iterable[int]] = None) -> List[CandidatePair]:
+        """Кандидаты для всех (или указанных) событий Kalshi, отсортированные по убыванию оценки"""
+        pairs = []
+        for kalshi_id in (self.kalshi.documents if kalshi_ids is None else kalshi_ids):
+            pairs.extend(self.candidates_for_kalshi(kalshi_id, k))
+        pairs.sort(key=lambda pair: pair.score, reverse=True)
+        return pairs
+
+    def _changed_since(self, model, watermark):
+        """Условие инкрементальной выборки: updated_at позже watermark минус перекрытие"""
+        if watermark is None:
+            return true()
+        return model.updated_at > watermark - self.overlap
+
+    async def _load_documents(self, session: AsyncSession, stmt, index: _TrigramIndex, build, chunk_size: int):
+        """Индексирует строки (id, поля документа..., updated_at); возвращает id измененных документов и max updated_at"""
+        changed_ids, watermark = [], None
+        stream = await session.stream(stmt.execution_options(yield_per=chunk_size))
+        async for rows in stream.partitions(chunk_size):
+            for event_id, *fields, updated_at in rows:
+                document = build(*fields)
+                # Строки из окна перекрытия перечитываются повторно: неизмененные не считаются новыми
+                if index.documents.get(event_id) != document:
+                    index.add(event_id, document)
+                    changed_ids.append(event_id)
+                if updated_at is not None and (watermark is None or updated_at > watermark):
+                    watermark = updated_at
+        return changed_ids, watermark
+
+    @staticmethod
+    async def _prune_deleted(session: AsyncSession, model, index: _TrigramIndex) -> int:
+        live_ids = set((await session.execute(select(model.id))).scalars())
+        deleted = [doc_id for doc_id in index.documents if doc_id not in live_ids]
+        for doc_id in deleted:
+            index.remove(doc_id)
+        return len(deleted)
+
+    async def load_from_db(
+            self,
+            session: AsyncSession,
+            chunk_size: int = 10_000,
+            sync_deletes: bool = False
+    ) -> List[int]:
+        """
+        Обновляет индекс из БД.
+
+        События перечитываются по индексированной колонке updated_at: новые и
+        измененные после прошлой загрузки (с перекрытием overlap на поздно
+        закоммиченные транзакции) переиндексируются. Связанные пары
+        перечитываются целиком (это только пары id), поэтому измененные и
+        удаленные маппинги тоже учитываются.
+
+        :param
+            session: Асинхронная сессия SQLAlchemy
+            chunk_size: Количество строк, читаемых за раз
+            sync_deletes: Удалить из индекса события, удаленные из БД
+                (полный проход по id, его стоит делать реже)
+
+        :return
+            id новых и измененных событий Kalshi, для которых стоит запросить кандидатов
+        """
+        kalshi_stmt = (
+            select(
+                KalshiEvent.id, KalshiEvent.title, KalshiEvent.sub_title,
+                KalshiEvent.yes_sub_title, KalshiEvent.close_time, KalshiEvent.category,
+                KalshiEvent.updated_at
+            )
+            .where(self._changed_since(KalshiEvent, self.kalshi_watermark))
+            .order_by(KalshiEvent.updated_at, KalshiEvent.id)
+        )
+        changed_kalshi_ids, watermark = await self._load_documents(
+            session, kalshi_stmt, self.kalshi, self.kalshi_document, chunk_size
+        )
+        if watermark is not None:
+            self.kalshi_watermark = max(watermark, self.kalshi_watermark or watermark)
+
+        polymarket_stmt = (
+            select(
+                PolyMarketEvent.id, PolyMarketEvent.slug, PolyMarketEvent.description,
+                PolyMarketEvent.endDate, PolyMarketEvent.tags, PolyMarketEvent.updated_at
+            )
+            .where(self._changed_since(PolyMarketEvent, self.polymarket_watermark))
+            .order_by(PolyMarketEvent.updated_at, PolyMarketEvent.id)
+        )
+        _, watermark = await self._load_documents(
+            session, polymarket_stmt, self.polymarket, self.polymarket_document, chunk_size
+        )
+        if watermark is not None:
+            self.polymarket_watermark = max(watermark, self.polymarket_watermark or watermark)
+
+        if sync_deletes:
+            removed = await self._prune_deleted(session, KalshiEvent, self.kalshi)
+            removed += await self._prune_deleted(session, PolyMarketEvent, self.polymarket)
+            if removed:
+                logging.debug(f"Matcher index: removed {removed} deleted events")
+
+        mapped_polymarket: Dict[int, Set[int]] = defaultdict(set)
+        mapped_kalshi: Dict[int, Set[int]] = defaultdict(set)
+        mapping_stmt = select(MappingEvent.kalshi_id, MappingEvent.polymarket_id)
+        for kalshi_id, polymarket_id in (await session.execute(mapping_stmt)).all():
+            mapped_polymarket[kalshi_id].add(polymarket_id)
+            mapped_kalshi[polymarket_id].add(kalshi_id)
+        self.mapped_polymarket, self.mapped_kalshi = mapped_polymarket, mapped_kalshi
+
+        logging.debug(
+            f"Matcher index: {len(self.kalshi.documents)} Kalshi, "
+            f"{len(self.polymarket.documents)} Polymarket, {len(mapped_polymarket)} mapped Kalshi events"
+        )
+        return changed_kalshi_ids
+
+    async def confirm(
+            self,
+            session: AsyncSession,
+            pair: CandidatePair,
+            polymarket_outcome: str
+    ) -> Optional[MappingEvent]:
+        """Создает маппинг для подтвержденной пары через create_mapping_event"""
+        mapping = await create_mapping_event(session, pair.kalshi_id, pair.polymarket_id, polymarket_outcome)
+        if mapping is not None:
+            self._mark_mapped(pair.kalshi_id, pair.polymarket_id)
+        return mapping
@@ -0,0 +1,486 @@
+import asyncio
+import logging
+import re
+import sys
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional
+
+import asyncpg
+from sqlalchemy import Column, Index, Table, exc, inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex, CreateTable as CreateTableDDL
+
+from database.models.base import Base
+
+
+# progress(операция, сделано, всего)
+Progress = Callable[['Operation', int, int], None]
+
+
+def _log_progress(operation: 'Operation', done: int, total: int) -> None:
+    logging.info(f"{operation.describe()}: {done}/{total}")
+
+
+@asynccontextmanager
+async def _connection(
+        engine: AsyncEngine,
+        lock_timeout: str,
+        autocommit: bool = False
+) -> AsyncIterator[AsyncConnection]:
+    """Соединение с заданным lock_timeout; при autocommit каждый запрос - своя транзакция"""
+    if engine.dialect.name != 'postgresql':
+        # lock_timeout есть только в PostgreSQL
+        async with engine.connect() as conn:
+            if autocommit:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            yield conn
+        return
+
+    async with engine.connect() as conn:
+        if autocommit:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        await conn.execute(text(f"SET lock_timeout = '{lock_timeout}'"))
+        try:
+            yield conn
+        finally:
+            if not conn.closed and not conn.invalidated:
+                if conn.in_transaction():
+                    await conn.rollback()
+                await conn.execute(text("RESET lock_timeout"))
+                if not autocommit:
+                    await conn.commit()
+
+
+def _is_lock_timeout(error: Exception) -> bool:
+    orig = getattr(error, 'orig', None)
+    return getattr(orig, 'sqlstate', None) == asyncpg.exceptions.LockNotAvailableError.sqlstate
+
+
+async def _drop_invalid_index(conn: AsyncConnection, name: str) -> None:
+    """Удаляет невалидный индекс, оставшийся от прерванного CREATE INDEX CONCURRENTLY"""
+    invalid = await conn.scalar(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {'name': name})
+    if invalid:
+        logging.warning(f"Dropping invalid index {name} left by a failed build")
+        await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+
+_SQL_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+
+def _replace_identifier(sql: str, old: str, new: str) -> str:
+    """Заменяет идентификатор колонки old на "new" в SQL вне строковых литералов"""
+    patterns = [re.escape(f'"{old}"')]
+    if re.fullmatch(r'[a-z_][a-z0-9_$]*', old):
+        # Имя без кавычек: не часть другого идентификатора, не квалифицированное имя и не функция
+        patterns.append(rf'(?<![\w$".]){re.escape(old)}(?![\w$"])(?!\s*\()')
+    pattern = re.compile('|'.join(patterns))
+    parts = _SQL_STRING_LITERAL.split(sql)
+    return ''.join(
+        part if index % 2 else pattern.sub(f'"{new}"', part)
+        for index, part in enumerate(parts)
+    )
+
+
+class _ColumnIndex(NamedTuple):
+    name: str
+    definition: str
+    constraint: Optional[str]
+    constraint_type: Optional[str]
+
+
+class Operation:
+    """Шаг миграции. apply выполняется runner'ом с заданным lock_timeout"""
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+    async def apply(self, engine: AsyncEngine, lock_timeout: str, progress: Progress) -> None:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}: {self.describe()}>"
+
+
+class CreateTable(Operation):
+    """Создание новой таблицы вместе с ее индексами (таблица пустая, блокировать нечего)"""
+
+    def __init__(self, table: Table):
+        self.table = table
+
+    def describe(self) -> str:
+        return f"create table {self.table.name}"
+
+    async def apply(self, engine, lock_timeout, progress):
+        async with _connection(engine, lock_timeout) as conn:
+            await conn.execute(CreateTableDDL(self.table, if_not_exists=True))
+            for index in self.table.indexes:
+                await conn.execute(CreateIndex(index, if_not_exists=True))
+            await conn.commit()
+
+
+class AddColumn(Operation):
+    """
+    Добавление колонки с server_default модели, но без NOT NULL.
+
+    В PostgreSQL 11+ ADD COLUMN с неволатильным DEFAULT (константа, now())
+    меняет только каталог, без перезаписи таблицы, и существующие строки
+    получают значение по умолчанию. SQLite не принимает в ADD COLUMN
+    неконстантный DEFAULT (CURRENT_TIMESTAMP), поэтому там колонка
+    добавляется без него, а существующие строки заполняются UPDATE.
+    NOT NULL, если нужен, добавляется отдельно через
+    AddCheckConstraint + ValidateConstraint после заполнения колонки.
+    """
+
+    def __init__(self, table_name: str, column: Column):
+        self.table_name = table_name
+        self.column = column
+
+    def describe(self) -> str:
+        return f"add column {self.table_name}.{self.column.name}"
+
+    def _default_sql(self, dialect) -> Optional[str]:
+        if self.column.server_default is None:
+            return None
+        return dialect.ddl_compiler(dialect, None).get_column_default_string(self.column)
+
+    async def apply(self, engine, lock_timeout, progress):
+        async with _connection(engine, lock_timeout) as conn:
+            column_type = self.column.type.compile(dialect=conn.dialect)
+            default = self._default_sql(conn.dialect)
+            postgresql = conn.dialect.name == 'postgresql'
+            if not postgresql:
+                live_columns = await conn.run_sync(lambda c: inspect(c).get_columns(self.table_name))
+                if any(column['name'] == self.column.name for column in live_columns):
+                    return
+
+            # Строковый server_default - литерал, остальные (func.now(), text()) - выражения
+            backfill = None
+            if default is not None and not postgresql and not isinstance(self.column.server_default.arg, str):
+                backfill, default = default, None
+
+            await conn.execute(text(
+                f'ALTER TABLE {self.table_name} ADD COLUMN {"IF NOT EXISTS " if postgresql else ""}'
+                f'"{self.column.name}" {column_type}{f" DEFAULT {default}" if default is not None else ""}'
+            ))
+            if backfill is not None:
+                await conn.execute(text(f'UPDATE {self.table_name} SET "{self.column.name}" = {backfill}'))
+                logging.warning(
+                    f"{self.table_name}.{self.column.name}: {conn.dialect.name} cannot add a column with "
+                    f"non-constant DEFAULT {backfill}; existing rows were backfilled, new rows rely on the model default"
+                )
+            await conn.commit()
+        if not self.column.nullable and not self.column.primary_key:
+            logging.warning(
+                f"{self.table_name}.{self.column.name} is NOT NULL in the model but was added as nullable; "
+                f"backfill it and add the constraint with AddCheckConstraint/ValidateConstraint"
+            )
+
+
+class CreateIndexConcurrently(Operation):
+    """CREATE INDEX CONCURRENTLY: не блокирует запись; невалидный остаток прошлой попытки удаляется"""
+
+    def __init__(self, index: Index):
+        self.index = index
+
+    def describe(self) -> str:
+        return f"create index {self.index.name} on {self.index.table.name}"
+
+    async def apply(self, engine, lock_timeout, progress):
+        if engine.dialect.name != 'postgresql':
+            async with engine.begin() as conn:
+                await conn.execute(CreateIndex(self.index, if_not_exists=True))
+            return
+
+        async with _connection(engine, lock_timeout, autocommit=True) as conn:
+            await _drop_invalid_index(conn, self.index.name)
+
+            ddl = str(CreateIndex(self.index, if_not_exists=True).compile(dialect=conn.dialect))
+            ddl = ddl.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1)
+            await conn.execute(text(ddl))
+
+
+class BackfillColumn(Operation):
+    """
+    Заполнение колонки выражением порциями по диапазонам id.
+
+    Каждая порция - отдельная короткая транзакция, поэтому блокировки строк
+    держатся недолго и не накапливаются.
+    """
+
+    def __init__(self, table_name: str, column_name: str, expression: str, chunk_size: int = 5000):
+        self.table_name = table_name
+        self.column_name = column_name
+        self.expression = expression
+        self.chunk_size = chunk_size
+
+    def describe(self) -> str:
+        return f"backfill {self.table_name}.{self.column_name} = {self.expression}"
+
+    async def apply(self, engine, lock_timeout, progress):
+        async with _connection(engine, lock_timeout, autocommit=True) as conn:
+            bounds = (await conn.execute(text(
+                f"SELECT min(id), max(id) FROM {self.table_name}"
+            ))).one()
+            if bounds[0] is None:
+                return
+            low, high = bounds
+            total = high - low + 1
+            for start in range(low, high + 1, self.chunk_size):
+                await conn.execute(text(
+                    f'UPDATE {self.table_name} SET "{self.column_name}" = {self.expression} '
+                    f'WHERE id >= :start AND id < :end AND "{self.column_name}" IS NULL'
+                ), {'start': start, 'end': start + self.chunk_size})
+                progress(self, min(start + self.chunk_size - low, total), total)
+
+
+class AddCheckConstraint(Operation):
+    """ADD CONSTRAINT ... NOT VALID: проверяются только новые строки, без сканирования таблицы"""
+
+    def __init__(self, table_name: str, name: str, condition: str):
+        self.table_name = table_name
+        self.name = name
+        self.condition = condition
+
+    def describe(self) -> str:
+        return f"add constraint {self.name} on {self.table_name} (not valid)"
+
+    async def apply(self, engine, lock_timeout, progress):
+        async with _connection(engine, lock_timeout) as conn:
+            await conn.execute(text(
+                f'ALTER TABLE {self.table_name} ADD CONSTRAINT "{self.name}" CHECK ({self.condition}) NOT VALID'
+            ))
+            await conn.commit()
+
+
+class ValidateConstraint(Operation):
+    """VALIDATE CONSTRAINT берет SHARE UPDATE EXCLUSIVE и не блокирует запись"""
+
+    def __init__(self, table_name: str, name: str):
+        self.table_name = table_name
+        self.name = name
+
+    def describe(self) -> str:
+        return f"validate constraint {self.name} on {self.table_name}"
+
+    async def apply(self, engine, lock_timeout, progress):
+        async with _connection(engine, lock_timeout) as conn:
+            await conn.execute(text(f'ALTER TABLE {self.table_name} VALIDATE CONSTRAINT "{self.name}"'))
+            await conn.commit()
+
+
+class ChangeColumnType(Operation):
+    """
+    Смена типа колонки без перезаписи таблицы под блокировкой.
+
+    1. Добавляется теневая колонка нового типа.
+    2. Триггер заполняет ее при каждой вставке и обновлении.
+    3. Существующие строки заполняются порциями.
+    4. Для каждого индекса и уникального ограничения, использующего колонку
+       (в ключе, выражении или условии), по теневой колонке конкурентно
+       строится такой же индекс. Если индекс несовместим с новым типом,
+       операция прерывается до удаления старой колонки.
+    5. В короткой транзакции триггер и старая колонка (вместе с ее
+       индексами) удаляются, теневая колонка и новые индексы получают
+       прежние имена, уникальные ограничения восстанавливаются по новым индексам.
+
+    Колонки первичного ключа и исключающих ограничений не поддерживаются.
+
+    Пример для строковых времен Kalshi:
+        ChangeColumnType('kalshi_events', 'close_time', 'timestamptz',
+                         'NULLIF({col}, \\'\\')::timestamptz')
+    """
+
+    def __init__(self, table_name: str, column_name: str, new_type: str, using: str, chunk_size: int = 5000):
+        self.table_name = table_name
+        self.column_name = column_name
+        self.new_type = new_type
+        self.using = using
+        self.chunk_size = chunk_size
+        self.shadow = f"{column_name}__new"
+        self.trigger = f"{table_name}_{column_name}_sync"
+
+    def describe(self) -> str:
+        return f"change type of {self.table_name}.{self.column_name} to {self.new_type}"
+
+    @staticmethod
+    def _shadow_index_name(name: str) -> str:
+        # Имена в Postgres ограничены 63 байтами
+        return f"{name[:58]}__new"
+
+    async def _column_indexes(self, conn: AsyncConnection) -> List[_ColumnIndex]:
+        """Индексы таблицы, которые удалит DROP COLUMN: колонка в ключе, выражении или условии"""
+        rows = await conn.execute(text(
+            "SELECT i.relname, pg_get_indexdef(i.oid), c.conname, c.contype "
+            "FROM pg_index x "
+            "JOIN pg_class i ON i.oid = x.indexrelid "
+            "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid "
+            "WHERE x.indrelid = CAST(:table AS regclass)"
+        ), {'table': self.table_name})
+        indexes = []
+        for name, definition, constraint, constraint_type in rows:
+            body = definition.split(' USING ', 1)[1]
+            if _replace_identifier(body, self.column_name, self.shadow) != body:
+                indexes.append(_ColumnIndex(name, definition, constraint, constraint_type))
+        return indexes
+
+    def _shadow_index_ddl(self, index: _ColumnIndex) -> str:
+        head, body = index.definition.split(' USING ', 1)
+        unique = 'UNIQUE ' if head.startswith('CREATE UNIQUE') else ''
+        target = head.split(' ON ', 1)[1]
+        return (
+            f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS "{self._shadow_index_name(index.name)}" '
+            f'ON {target} USING {_replace_identifier(body, self.column_name, self.shadow)}'
+        )
+
+    async def apply(self, engine, lock_timeout, progress):
+        source = f'NEW."{self.column_name}"'
+        async with _connection(engine, lock_timeout) as conn:
+            indexes = await self._column_indexes(conn)
+            unsupported = [index.name for index in indexes if index.constraint_type in ('p', 'x')]
+            if unsupported:
+                raise ValueError(
+                    f"{self.table_name}.{self.column_name} is used by primary key/exclusion "
+                    f"constraint indexes {', '.join(unsupported)}; ChangeColumnType cannot rebuild them"
+                )
+            await conn.execute(text(
+                f'ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS "{self.shadow}" {self.new_type}'
+            ))
+            await conn.execute(text(
+                f'CREATE OR REPLACE FUNCTION "{self.trigger}"() RETURNS trigger AS $$ '
+                f'BEGIN NEW."{self.shadow}" := {self.using.format(col=source)}; RETURN NEW; END; '
+                f'$$ LANGUAGE plpgsql'
+            ))
+            await conn.execute(text(f'DROP TRIGGER IF EXISTS "{self.trigger}" ON {self.table_name}'))
+            await conn.execute(text(
+                f'CREATE TRIGGER "{self.trigger}" BEFORE INSERT OR UPDATE ON {self.table_name} '
+                f'FOR EACH ROW EXECUTE FUNCTION "{self.trigger}"()'
+            ))
+            await conn.commit()
+
+        backfill = BackfillColumn(
+            self.table_name,
+            self.shadow,
+            self.using.format(col=f'"{self.column_name}"'),
+            self.chunk_size
+        )
+        await backfill.apply(engine, lock_timeout, lambda _op, done, total: progress(self, done, total))
+
+        # Индексы строятся до удаления старой колонки: ошибка здесь ничего не ломает
+        async with _connection(engine, lock_timeout, autocommit=True) as conn:
+            for index in indexes:
+                await _drop_invalid_index(conn, self._shadow_index_name(index.name))
+                logging.info(f"Building {self._shadow_index_name(index.name)} to replace {index.name}")
+                await conn.execute(text(self._shadow_index_ddl(index)))
+
+        async with _connection(engine, lock_timeout) as conn:
+            await conn.execute(text(f'DROP TRIGGER IF EXISTS "{self.trigger}" ON {self.table_name}'))
+            await conn.execute(text(f'ALTER TABLE {self.table_name} DROP COLUMN "{self.column_name}"'))
+            await conn.execute(text(
+                f'ALTER TABLE {self.table_name} RENAME COLUMN "{self.shadow}" TO "{self.column_name}"'
+            ))
+            for index in indexes:
+                shadow_index = self._shadow_index_name(index.name)
+                if index.constraint_type == 'u':
+                    # Индекс переименовывается в имя ограничения автоматически
+                    await conn.execute(text(
+                        f'ALTER TABLE {self.table_name} ADD CONSTRAINT "{index.constraint}" '
+                        f'UNIQUE USING INDEX "{shadow_index}"'
+                    ))
+                else:
+                    await conn.execute(text(f'ALTER INDEX "{shadow_index}" RENAME TO "{index.name}"'))
+            await conn.execute(text(f'DROP FUNCTION IF EXISTS "{self.trigger}"()'))
+            await conn.commit()
+
+
+def _diff(sync_conn) -> List[Operation]:
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+
+    create_tables, add_columns, create_indexes = [], [], []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            create_tables.append(CreateTable(table))
+            continue
+
+        live_columns = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            live = live_columns.get(column.name)
+            if live is None:
+                add_columns.append(AddColumn(table.name, column))
+            elif live['type']._type_affinity is not column.type._type_affinity:
+                logging.warning(
+                    f"Type of {table.name}.{column.name} differs: live {live['type']}, model {column.type}; "
+                    f"use ChangeColumnType to convert it"
+                )
+
+        live_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        live_indexes |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name not in live_indexes:
+                create_indexes.append(CreateIndexConcurrently(index))
+
+    # Сначала таблицы (в порядке внешних ключей), затем колонки, затем индексы по ним
+    return create_tables + add_columns + create_indexes
+
+
+async def diff_schema(engine: AsyncEngine) -> List[Operation]:
+    """Сравнивает модели с живой схемой и возвращает упорядоченный список операций"""
+    async with engine.connect() as conn:
+        return await conn.run_sync(_diff)
+
+
+async def apply_migrations(
+        engine: AsyncEngine,
+        operations: List[Operation],
+        lock_timeout: str = '5s',
+        retries: int = 5,
+        progress: Optional[Progress] = None
+) -> bool:
+    """
+    Последовательно применяет операции.
+
+    Каждая операция выполняется с lock_timeout: если нужную блокировку не
+    удалось получить быстро, операция откатывается и повторяется с
+    экспоненциальной задержкой, вместо того чтобы выстраивать за собой
+    очередь из запросов приложения.
+
+    :return
+        True если все операции применены
+    """
+    progress = progress or _log_progress
+    for number, operation in enumerate(operations, start=1):
+        logging.info(f"[{number}/{len(operations)}] {operation.describe()}")
+        for attempt in range(retries + 1):
+            try:
+                await operation.apply(engine, lock_timeout, progress)
+                break
+            except exc.DBAPIError as e:
+                if not _is_lock_timeout(e) or attempt == retries:
+                    logging.error(f"Migration step failed: {operation.describe()}: {str(e)}")
+                    return False
+                delay = 2 ** attempt
+                logging.warning(f"Lock timeout on {operation.describe()}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+    return True
+
+
+if __name__ == '__main__':
+    from database.services.database import db
+
+    async def main():
+        logging.basicConfig(level=logging.INFO)
+        try:
+            operations = await diff_schema(db.engine)
+            if not operations:
+                print("Схема соответствует моделям")
+            for operation in operations:
+                print(operation.describe())
+            if operations and '--apply' in sys.argv:
+                await apply_migrations(db.engine, operations)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional
+
+import asyncpg
+from sqlalchemy import delete, exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from database.models.ChangeLog import ChangeLog
+
+
+# Таблицы, изменения которых публикуются, и колонка-ключ строки в событии
+CHANGE_TABLES = {
+    'kalshi_events': 'ticker',
+    'polymarket_events': 'conditionId',
+    'mapping_events': 'id',
+}
+
+CHANNEL_PREFIX = 'changes_'
+
+# Одна запись change_log и одно уведомление на SQL-оператор, а не на строку:
+# bulk-загрузка в 500k строк дает несколько сотен записей журнала.
+# TG_ARGV[0] - колонка-ключ, TG_ARGV[1] - срок хранения журнала в секундах.
+_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_statement_change() RETURNS trigger AS $$
+DECLARE
+    keys jsonb;
+    changed jsonb := '[]'::jsonb;
+    log_id bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(to_jsonb(n) ->> TG_ARGV[0]) INTO keys FROM new_rows AS n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(to_jsonb(o) ->> TG_ARGV[0]) INTO keys FROM old_rows AS o;
+    ELSE
+        -- updated_at меняется при любом UPDATE, поэтому в сравнении не участвует
+        SELECT jsonb_agg(DISTINCT d.row_key), coalesce(jsonb_agg(DISTINCT d.col), '[]'::jsonb)
+        INTO keys, changed
+        FROM (
+            SELECT to_jsonb(n) ->> TG_ARGV[0] AS row_key, c.key AS col
+            FROM new_rows AS n
+            JOIN old_rows AS o ON o.id = n.id
+            CROSS JOIN LATERAL jsonb_each(to_jsonb(n)) AS c
+            WHERE c.key <> 'updated_at' AND c.value IS DISTINCT FROM (to_jsonb(o) -> c.key)
+        ) AS d;
+    END IF;
+
+    IF keys IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO change_log (txid, table_name, operation, row_keys, changed_columns)
+    VALUES (pg_current_xact_id()::text::bigint, TG_TABLE_NAME, TG_OP, keys::text, changed::text)
+    RETURNING id INTO log_id;
+
+    -- Встроенная очистка журнала: примерно раз в 1000 записей
+    IF log_id % 1000 = 0 THEN
+        DELETE FROM change_log WHERE created_at < now() - make_interval(secs => TG_ARGV[1]::double precision);
+    END IF;
+
+    -- Одинаковые уведомления в одной транзакции Postgres схлопывает в одно
+    PERFORM pg_notify('""" + CHANNEL_PREFIX + """' || TG_TABLE_NAME, '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+_TRIGGER_EVENTS = {
+    'insert': 'INSERT REFERENCING NEW TABLE AS new_rows',
+    'update': 'UPDATE REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'delete': 'DELETE REFERENCING OLD TABLE AS old_rows',
+}
+
+_HORIZON_QUERY = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+
+
+class ChangeEvent(NamedTuple):
+    id: int
+    table: str
+    key: Optional[str]
+    operation: str
+    changed_columns: List[str]
+    # Позиция, с которой безопасно возобновить подписку (аргумент since)
+    horizon: int
+
+
+async def install_change_triggers(engine: AsyncEngine, retention: timedelta = timedelta(days=1)) -> None:
+    """
+    Создает таблицу change_log, функцию notify_statement_change и
+    statement-level триггеры AFTER INSERT/UPDATE/DELETE с transition-таблицами
+    на таблицах из CHANGE_TABLES (нужен PostgreSQL 13+).
+
+    Каждый оператор пишет одну запись журнала с ключами всех затронутых строк
+    и отправляет одно уведомление, которое Postgres доставляет только после
+    COMMIT. UPDATE без фактических изменений не публикуется. Записи старше
+    retention удаляются самими триггерами.
+    """
+    if engine.dialect.name != 'postgresql':
+        raise NotImplementedError("LISTEN/NOTIFY is only available on PostgreSQL")
+
+    retention_seconds = int(retention.total_seconds())
+    async with engine.begin() as conn:
+        await conn.run_sync(ChangeLog.__table__.create, checkfirst=True)
+        await conn.execute(text(_TRIGGER_FUNCTION))
+        for table, key_column in CHANGE_TABLES.items():
+            # Старый построчный триггер
+            await conn.execute(text(f'DROP TRIGGER IF EXISTS {table}_notify_change ON {table}'))
+            for suffix, trigger_event in _TRIGGER_EVENTS.items():
+                trigger = f"{table}_notify_{suffix}"
+                await conn.execute(text(f'DROP TRIGGER IF EXISTS {trigger} ON {table}'))
+                await conn.execute(text(
+                    f'CREATE TRIGGER {trigger} AFTER {trigger_event} '
+                    f"FOR EACH STATEMENT EXECUTE FUNCTION notify_statement_change('{key_column}', '{retention_seconds}')"
+                ))
+        await conn.execute(text('DROP FUNCTION IF EXISTS notify_row_change()'))
+    logging.info(f"Change triggers installed on {', '.join(CHANGE_TABLES)}")
+
+
+async def prune_change_log(session: AsyncSession, keep_seconds: int = 86400) -> int:
+    """
+    Удаляет из change_log записи старше keep_seconds, возвращает количество удаленных.
+
+    Триггеры чистят журнал сами, функция нужна для внеочередной очистки.
+    """
+    try:
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=keep_seconds)
+        stmt = delete(ChangeLog).where(ChangeLog.created_at < threshold)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
+    except Exception as e:
+        logging.error(f"Error pruning change log: {str(e)}")
+        await session.rollback()
+        return 0
+
+
+async def _fetch_since(pg_connection, tables: List[str], horizon: int) -> List[asyncpg.Record]:
+    """Записи журнала транзакций с txid >= horizon (они могли закоммититься после прошлого чтения)"""
+    return await pg_connection.fetch(
+        'SELECT id, txid, table_name, operation, row_keys, changed_columns '
+        'FROM change_log WHERE txid >= $1 AND table_name = ANY($2::text[]) ORDER BY id',
+        horizon,
+        tables,
+    )
+
+
+async def subscribe_changes(
+        engine: AsyncEngine,
+        tables: Optional[Iterable[str]] = None,
+        since: Optional[int] = None,
+        poll_interval: float = 5.0,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0
+) -> AsyncIterator[ChangeEvent]:
+    """
+    Асинхронный генератор событий изменений через LISTEN/NOTIFY.
+
+    Занимает одно соединение из пула engine и слушает каналы
+    ``changes_<table>``. Уведомление только будит подписчика, а события
+    читаются из change_log в порядке коммитов: перечитываются записи всех
+    транзакций с txid не меньше горизонта снапшота (pg_snapshot_xmin) прошлого
+    чтения. Транзакции ниже горизонта к тому моменту уже завершились, поэтому
+    поздно закоммиченные записи с меньшим id не теряются ни при работе, ни
+    при переподключении. Повторы отсекаются по id записи журнала.
+
+    Доставка "хотя бы один раз": чтобы продолжить после перезапуска, сохраните
+    event.horizon обработанного события и передайте его в since.
+
+    :param
+        engine: AsyncEngine (например db.engine)
+        tables: Таблицы для подписки (по умолчанию все из CHANGE_TABLES)
+        since: horizon, с которого продолжить; None - только новые события
+        poll_interval: Как часто перечитывать журнал без уведомлений, сек
+        reconnect_delay: Начальная задержка перед переподключением, сек
+        max_reconnect_delay: Максимальная задержка перед переподключением, сек
+
+    Пример:
+        async for event in subscribe_changes(db.engine, ['kalshi_events']):
+            print(event.table, event.key, event.changed_columns)
+    """
+    if engine.dialect.name != 'postgresql':
+        raise NotImplementedError("LISTEN/NOTIFY is only available on PostgreSQL")
+
+    tables = list(tables or CHANGE_TABLES)
+    unknown = set(tables) - set(CHANGE_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+
+    horizon = since
+    # id -> txid уже отданных записей журнала с txid >= horizon
+    seen: Dict[int, int] = {}
+    delay = reconnect_delay
+    while True:
+        wakeup = asyncio.Event()
+        disconnected = []
+        listeners: Dict[str, object] = {}
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                pg_connection = raw.driver_connection
+
+                def on_notify(_connection, _pid, _channel, _payload):
+                    wakeup.set()
+
+                def on_disconnect(_connection):
+                    disconnected.append(True)
+                    wakeup.set()
+
+                try:
+                    for table in tables:
+                        listeners[CHANNEL_PREFIX + table] = on_notify
+                        await pg_connection.add_listener(CHANNEL_PREFIX + table, on_notify)
+                    pg_connection.add_termination_listener(on_disconnect)
+
+                    if horizon is None:
+                        # Только новые события: уже видимые записи считаем отданными
+                        horizon = await pg_connection.fetchval(_HORIZON_QUERY)
+                        for row in await _fetch_since(pg_connection, tables, horizon):
+                            seen[row['id']] = row['txid']
+
+                    logging.info(f"Subscribed to changes of {', '.join(tables)} from horizon {horizon}")
+                    delay = reconnect_delay
+
+                    while True:
+                        wakeup.clear()
+                        # Горизонт берется до чтения: все транзакции ниже него уже видны
+                        next_horizon = await pg_connection.fetchval(_HORIZON_QUERY)
+                        for row in await _fetch_since(pg_connection, tables, horizon):
+                            if row['id'] in seen:
+                                continue
+                            seen[row['id']] = row['txid']
+                            changed_columns = json.loads(row['changed_columns'] or '[]')
+                            for key in json.loads(row['row_keys']):
+                                yield ChangeEvent(
+                                    row['id'], row['table_name'], key, row['operation'], changed_columns, horizon
+                                )
+                        horizon = max(horizon, next_horizon)
+                        seen = {log_id: txid for log_id, txid in seen.items() if txid >= horizon}
+
+                        if not disconnected:
+                            try:
+                                await asyncio.wait_for(wakeup.wait(), poll_interval)
+                            except asyncio.TimeoutError:
+                                pass
+                        if disconnected:
+                            raise ConnectionError("LISTEN connection terminated")
+                finally:
+                    if not pg_connection.is_closed():
+                        pg_connection.remove_termination_listener(on_disconnect)
+                        for channel, callback in listeners.items():
+                            await pg_connection.remove_listener(channel, callback)
+                    else:
+                        await conn.invalidate()
+
+        except (OSError, ConnectionError, asyncpg.PostgresError, asyncpg.InterfaceError, exc.DBAPIError) as e:
+            logging.warning(f"Change subscription lost: {str(e)}, reconnecting in {delay:.1f}s")
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_reconnect_delay)
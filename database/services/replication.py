@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+
+from database.CRUDs.conditional_writes import dialect_insert
+from database.models.base import Base
+from database.models.KalshiEvent import KalshiEvent
+from database.models.MappingEvent import MappingEvent
+from database.models.PolyMarketEvent import PolyMarketEvent
+from database.services.database import Database
+from database.services.export import DEFAULT_WATERMARK_OVERLAP
+
+
+# Порядок учитывает внешние ключи: события раньше маппингов
+REPLICATED_MODELS = (KalshiEvent, PolyMarketEvent, MappingEvent)
+
+# Лимит параметров одного запроса SQLite (SQLITE_MAX_VARIABLE_NUMBER)
+SQLITE_MAX_PARAMS = 32766
+
+# Колонка, по которой копируются только изменившиеся строки
+WATERMARK_COLUMN = 'updated_at'
+
+
+def _chunked(values: Sequence, size: int) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+async def _fetch_ids(database: Database, model) -> set:
+    async with database.session() as session:
+        return set((await session.execute(select(model.id))).scalars())
+
+
+async def _copy_rows(source_session, target_session, insert, table, query, rows_per_statement: int) -> int:
+    """Потоково читает query из source и upsert'ит строки в target по id"""
+    copied = 0
+    result = await source_session.stream(query.execution_options(yield_per=rows_per_statement))
+    async for partition in result.mappings().partitions(rows_per_statement):
+        stmt = insert(table).values([dict(row) for row in partition])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={column.name: stmt.excluded[column.name] for column in table.columns if column.name != 'id'},
+        )
+        await target_session.execute(stmt)
+        copied += len(partition)
+    return copied
+
+
+async def _target_watermark(database: Database, table) -> Optional[datetime]:
+    """Максимальный updated_at реплики; SQLite хранит его без часового пояса (значения из asyncpg - UTC)"""
+    async with database.session() as session:
+        watermark = await session.scalar(select(func.max(table.c[WATERMARK_COLUMN])))
+    if isinstance(watermark, datetime) and watermark.tzinfo is None:
+        watermark = watermark.replace(tzinfo=timezone.utc)
+    return watermark
+
+
+async def replicate_tables(
+        source: Database,
+        target: Database,
+        models: Sequence = REPLICATED_MODELS,
+        chunk_size: int = 5000,
+        sync_deletes: bool = True,
+        overlap: timedelta = DEFAULT_WATERMARK_OVERLAP
+) -> Dict[str, int]:
+    """
+    Синхронизирует справочные таблицы из source в target (обычно локальную SQLite).
+
+    Копируются только строки с updated_at больше максимального updated_at
+    реплики минус overlap (перекрытие покрывает транзакции, закоммиченные
+    позже более новых строк); пустая таблица реплики копируется целиком.
+    Полное сравнение id выполняется только при sync_deletes: оно удаляет
+    строки, которых нет в source, и докопирует строки, которых нет в target
+    (например вставленные длинной транзакцией с updated_at старше перекрытия). Вся синхронизация выполняется в одной
+    транзакции target, поэтому читатели (WAL) видят либо старое, либо новое состояние.
+
+    :param
+        source: Основная БД
+        target: Реплика
+        models: Модели в порядке внешних ключей
+        chunk_size: Количество строк, читаемых и записываемых за раз
+        sync_deletes: Сверить id: удалить лишние строки target и скопировать недостающие
+        overlap: Перекрытие watermark
+
+    :return
+        Количество скопированных строк по таблицам
+    """
+    async with target.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[model.__table__ for model in models])
+
+    stale_ids, missing_ids = {}, {}
+    if sync_deletes:
+        for model in models:
+            target_ids, source_ids = await _fetch_ids(target, model), await _fetch_ids(source, model)
+            stale_ids[model] = sorted(target_ids - source_ids)
+            missing_ids[model] = sorted(source_ids - target_ids)
+
+    watermarks = {}
+    for model in models:
+        if WATERMARK_COLUMN in model.__table__.c:
+            watermarks[model] = await _target_watermark(target, model.__table__)
+
+    insert = dialect_insert(target.dialect_name)
+    copied = {}
+    async with source.session() as source_session, target.session() as target_session:
+        # Удаляем в обратном порядке, чтобы не нарушить внешние ключи
+        for model in reversed(models):
+            for ids in _chunked(stale_ids.get(model, []), SQLITE_MAX_PARAMS):
+                await target_session.execute(delete(model).where(model.id.in_(ids)))
+
+        for model in models:
+            table = model.__table__
+            rows_per_statement = max(1, min(chunk_size, SQLITE_MAX_PARAMS // len(table.columns)))
+            copied[table.name] = 0
+
+            query = select(*table.columns).order_by(table.c.id)
+            behind = None
+            if watermarks.get(model) is not None:
+                changed = table.c[WATERMARK_COLUMN] > watermarks[model] - overlap
+                query, behind = query.where(changed), ~changed | table.c[WATERMARK_COLUMN].is_(None)
+
+            queries = [query]
+            if behind is not None:
+                # Недостающие строки, не попавшие в выборку по watermark (без watermark копируется все)
+                for ids in _chunked(missing_ids.get(model, []), SQLITE_MAX_PARAMS):
+                    queries.append(
+                        select(*table.columns).where(table.c.id.in_(ids), behind).order_by(table.c.id)
+                    )
+
+            for query in queries:
+                copied[table.name] += await _copy_rows(
+                    source_session, target_session, insert, table, query, rows_per_statement
+                )
+
+        await target_session.commit()
+
+    removed = {model.__tablename__: len(ids) for model, ids in stale_ids.items()}
+    logging.info(f"Replicated {copied}; removed {removed if sync_deletes else 'not checked'}")
+    return copied
+
+
+async def run_replication(
+        source: Database,
+        target: Database,
+        interval: float = 60.0,
+        delete_sync_interval: float = 3600.0,
+        stop_event: Optional[asyncio.Event] = None,
+        **kwargs
+) -> None:
+    """
+    Периодически вызывает replicate_tables до установки stop_event.
+
+    Изменения копируются каждые interval секунд, а полное сравнение id для
+    удалений выполняется при первом прогоне и затем не чаще раза
+    в delete_sync_interval секунд. Ошибка одного прогона логируется и не
+    останавливает цикл.
+    """
+    stop_event = stop_event or asyncio.Event()
+    last_delete_sync = None
+    while not stop_event.is_set():
+        started = time.monotonic()
+        sync_deletes = last_delete_sync is None or started - last_delete_sync >= delete_sync_interval
+        try:
+            await replicate_tables(source, target, sync_deletes=sync_deletes, **kwargs)
+            if sync_deletes:
+                last_delete_sync = started
+        except Exception as e:
+            logging.error(f"Replication failed: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), max(0.0, interval - (time.monotonic() - started)))
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,81 @@
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+@lru_cache(maxsize=None)
+def column_keys(model) -> Tuple[str, ...]:
+    """Ключи колонок модели в порядке таблицы (вычисляются один раз на модель)"""
+    return tuple(column.key for column in model.__table__.columns)
+
+
+def normalized_values(model, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Оставляет в data только колонки модели и упорядочивает их как в таблице.
+
+    Для UPDATE ... SET порядок ключей словаря входит в ключ кеша компиляции
+    SQLAlchemy, хотя SQL получается одинаковым. Нормализация порядка дает
+    одинаковый ключ кеша для одинакового набора колонок.
+    """
+    return {key: data[key] for key in column_keys(model) if key in data}
+
+
+class StatementCacheStats:
+    """
+    Счетчики попаданий в кеш компиляции SQLAlchemy и в кеш prepared
+    statements asyncpg для engine.
+
+    Попадание в кеш asyncpg определяется по наличию SQL в LRU-кеше
+    prepared statements соединения до выполнения запроса.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.compiled_hits = 0
+        self.compiled_misses = 0
+        self.compiled_uncached = 0
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        cache_hit = getattr(context, 'cache_hit', None)
+        if cache_hit == CacheStats.CACHE_HIT:
+            self.compiled_hits += 1
+        elif cache_hit == CacheStats.CACHE_MISS:
+            self.compiled_misses += 1
+        else:
+            self.compiled_uncached += 1
+
+        dbapi_connection = getattr(conn.connection, 'dbapi_connection', None)
+        prepared_cache = getattr(dbapi_connection, '_prepared_statement_cache', None)
+        if prepared_cache is not None:
+            if statement in prepared_cache:
+                self.prepared_hits += 1
+            else:
+                self.prepared_misses += 1
+
+    @staticmethod
+    def _rate(hits: int, misses: int) -> float:
+        total = hits + misses
+        return hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        compiled_cache = self.engine.sync_engine._compiled_cache
+        return {
+            'compiled_hits': self.compiled_hits,
+            'compiled_misses': self.compiled_misses,
+            'compiled_uncached': self.compiled_uncached,
+            'compiled_hit_rate': self._rate(self.compiled_hits, self.compiled_misses),
+            'compiled_cache_size': len(compiled_cache) if compiled_cache is not None else 0,
+            'prepared_hits': self.prepared_hits,
+            'prepared_misses': self.prepared_misses,
+            'prepared_hit_rate': self._rate(self.prepared_hits, self.prepared_misses),
+        }
+
+    def reset(self) -> None:
+        self.compiled_hits = self.compiled_misses = self.compiled_uncached = 0
+        self.prepared_hits = self.prepared_misses = 0
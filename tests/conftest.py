@@ -0,0 +1,5 @@
+import os
+
+# database.services.database создает Database() при импорте: без PostgreSQL
+# тесты используют in-memory SQLite
+os.environ.setdefault('DB_DSN', 'sqlite+aiosqlite://')
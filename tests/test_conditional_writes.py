@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from database.CRUDs.conditional_writes import WriteResult, dedupe_by_seq
+from database.CRUDs.KalshiEvent_repository import (
+    create_kalshi_events_bulk, update_kalshi_event_if_newer, upsert_kalshi_events
+)
+from database.CRUDs.PolyMarketEvent_repository import _to_int, upsert_polymarket_events
+from database.models.base import Base
+from database.models.KalshiEvent import KalshiEvent
+from database.models.PolyMarketEvent import PolyMarketEvent
+from database.services.database import Database
+from database.services.ingestion import ingest_events
+
+
+def _run(scenario, create_tables: bool = True):
+    """Выполняет scenario(database) на чистой in-memory SQLite"""
+    async def run():
+        database = Database('sqlite+aiosqlite://')
+        try:
+            if create_tables:
+                async with database.engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+            return await scenario(database)
+        finally:
+            await database.engine.dispose()
+    return asyncio.run(run())
+
+
+async def _kalshi_rows(database: Database):
+    async with database.session() as session:
+        result = await session.execute(
+            select(KalshiEvent.ticker, KalshiEvent.title, KalshiEvent.source_seq).order_by(KalshiEvent.ticker)
+        )
+        return [tuple(row) for row in result.all()]
+
+
+def test_dedupe_collapses_consecutive_sequenced_rows():
+    rows = [
+        {'k': 1, 'source_seq': 3, 'v': 'a'},
+        {'k': 1, 'source_seq': 5, 'v': 'b'},
+        {'k': 1, 'source_seq': 4, 'v': 'c'},
+        {'k': 2, 'source_seq': 1, 'v': 'd'},
+    ]
+    rounds, dropped = dedupe_by_seq(rows, 'k')
+    assert rounds == [[{'k': 1, 'source_seq': 5, 'v': 'b'}, {'k': 2, 'source_seq': 1, 'v': 'd'}]]
+    assert dropped == 2
+
+
+def test_dedupe_equal_seq_keeps_later_row():
+    rounds, _ = dedupe_by_seq([{'k': 1, 'source_seq': 2, 'v': 'a'}, {'k': 1, 'source_seq': 2, 'v': 'b'}], 'k')
+    assert rounds == [[{'k': 1, 'source_seq': 2, 'v': 'b'}]]
+
+
+def test_dedupe_keeps_unsequenced_rows_in_order():
+    rows = [
+        {'k': 1, 'source_seq': 5, 'v': 'a'},
+        {'k': 1, 'v': 'b'},
+        {'k': 1, 'source_seq': 4, 'v': 'c'},
+        {'k': 2, 'v': 'd'},
+    ]
+    rounds, dropped = dedupe_by_seq(rows, 'k')
+    assert rounds == [
+        [{'k': 1, 'source_seq': 5, 'v': 'a'}, {'k': 2, 'v': 'd'}],
+        [{'k': 1, 'v': 'b'}],
+        [{'k': 1, 'source_seq': 4, 'v': 'c'}],
+    ]
+    assert dropped == 0
+    # В каждом раунде ключ встречается не больше одного раза (требование ON CONFLICT)
+    for round_rows in rounds:
+        assert len({row['k'] for row in round_rows}) == len(round_rows)
+
+
+def test_upsert_applies_only_newer_seq():
+    async def scenario(database):
+        async with database.session() as session:
+            first = await upsert_kalshi_events(session, [
+                {'ticker': 'A', 'event_ticker': 'E', 'title': 'a5', 'source_seq': 5},
+                {'ticker': 'B', 'event_ticker': 'E', 'title': 'b1', 'source_seq': 1},
+            ])
+            second = await upsert_kalshi_events(session, [
+                {'ticker': 'A', 'event_ticker': 'E', 'title': 'a4', 'source_seq': 4},
+                {'ticker': 'B', 'event_ticker': 'E', 'title': 'b2', 'source_seq': 2},
+            ])
+        return first, second, await _kalshi_rows(database)
+
+    first, second, rows = _run(scenario)
+    assert first == WriteResult(applied=2)
+    assert second == WriteResult(applied=1, stale=1)
+    assert rows == [('A', 'a5', 5), ('B', 'b2', 2)]
+
+
+def test_upsert_unsequenced_row_after_sequenced_one_is_applied():
+    async def scenario(database):
+        async with database.session() as session:
+            result = await upsert_kalshi_events(session, [
+                {'ticker': 'A', 'event_ticker': 'E', 'title': 'seq', 'source_seq': 5},
+                {'ticker': 'A', 'event_ticker': 'E', 'title': 'noseq'},
+                {'ticker': 'A', 'event_ticker': 'E', 'title': 'old', 'source_seq': 3},
+            ])
+        return result, await _kalshi_rows(database)
+
+    result, rows = _run(scenario)
+    assert result.ok
+    # Строка без source_seq применяется безусловно и не затирает сохраненный source_seq
+    assert rows == [('A', 'noseq', 5)]
+
+
+def test_update_if_newer_reports_stale_and_missing():
+    async def scenario(database):
+        async with database.session() as session:
+            await create_kalshi_events_bulk(session, [{'id': 1, 'ticker': 'A', 'event_ticker': 'E'}])
+            return [
+                await update_kalshi_event_if_newer(session, 1, {'title': 'x'}, 2),
+                await update_kalshi_event_if_newer(session, 1, {'title': 'y'}, 1),
+                await update_kalshi_event_if_newer(session, 2, {'title': 'z'}, 1),
+            ]
+
+    assert _run(scenario) == [WriteResult(applied=1), WriteResult(stale=1), WriteResult(missing=1)]
+
+
+def test_failed_writes_are_not_ok():
+    async def scenario(database):
+        async with database.session() as session:
+            return [
+                await upsert_kalshi_events(session, [{'ticker': 'A', 'event_ticker': 'E'}]),
+                await upsert_polymarket_events(session, [{'conditionId': '0x1', 'slug': 's'}]),
+                await upsert_kalshi_events(session, []),
+            ]
+
+    kalshi, polymarket, empty = _run(scenario, create_tables=False)
+    assert not kalshi.ok and 'kalshi_events' in kalshi.error
+    assert not polymarket.ok and 'polymarket_events' in polymarket.error
+    assert empty.ok and empty == WriteResult()
+
+
+def test_ingest_events_counts_write_results():
+    rows = [
+        {'ticker': 'A', 'event_ticker': 'E', 'source_seq': 2},
+        {'ticker': 'B', 'event_ticker': 'E', 'source_seq': 1},
+        {'ticker': 'A', 'event_ticker': 'E', 'source_seq': 1},
+    ]
+
+    async def scenario(database):
+        async with database.session() as session:
+            return await ingest_events(session, rows, upsert_kalshi_events, batch_size=2)
+
+    report = _run(scenario)
+    assert report.ok
+    assert (report.rows, report.written_rows, report.stale_rows) == (3, 2, 1)
+
+    failed = _run(scenario, create_tables=False)
+    assert not failed.ok
+    assert failed.written_rows == 0 and len(failed.errors) == 2
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1700000000123456789', 1700000000123456789),
+    ('42', 42),
+    ('1.0', 1),
+    (7, 7),
+    (2.0, 2),
+])
+def test_to_int_keeps_large_string_values_exact(value, expected):
+    assert _to_int(value) == expected
+
+
+def test_polymarket_string_seq_is_not_rounded():
+    seq = '1700000000123456789'
+
+    async def scenario(database):
+        async with database.session() as session:
+            await upsert_polymarket_events(session, [{'conditionId': '0x1', 'slug': 's', 'source_seq': seq}])
+            return await session.scalar(select(PolyMarketEvent.source_seq))
+
+    assert _run(scenario) == int(seq)
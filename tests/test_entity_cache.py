@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from database.models.KalshiEvent import KalshiEvent
+from database.services.entity_cache import EntityCache
+
+
+class _Loader:
+    """Loader, который ждет release и считает вызовы"""
+
+    def __init__(self, ticker: str = 'T', entity_id: int = 1):
+        self.ticker = ticker
+        self.entity_id = entity_id
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.error = None
+
+    async def __call__(self):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return KalshiEvent(id=self.entity_id, event_ticker=self.ticker, title=f'call {self.calls}')
+
+
+async def _settle():
+    """Дает запущенным задачам дойти до ожидания"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_misses_are_coalesced():
+    async def scenario():
+        cache, loader = EntityCache(), _Loader()
+        tasks = [asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader)) for _ in range(5)]
+        await _settle()
+        loader.release.set()
+        results = await asyncio.gather(*tasks)
+        return cache, loader, results
+
+    cache, loader, results = asyncio.run(scenario())
+    assert loader.calls == 1
+    assert len({id(result) for result in results}) == 1
+    assert results[0].event_ticker == 'T'
+    assert cache.stats() == {'size': 1, 'hits': 0, 'misses': 1, 'coalesced': 4}
+
+
+def test_leader_cancel_does_not_cancel_waiters():
+    async def scenario():
+        cache, loader = EntityCache(), _Loader()
+        leader = asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader))
+        await loader.started.wait()
+        waiters = [asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader)) for _ in range(3)]
+        await _settle()
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        await _settle()
+        loader.release.set()
+        return cache, loader, await asyncio.gather(*waiters)
+
+    cache, loader, results = asyncio.run(scenario())
+    # Загрузку продолжает один из ожидающих, остальные снова объединяются с ним
+    assert loader.calls == 2
+    assert all(result is not None and result.event_ticker == 'T' for result in results)
+    assert len({id(result) for result in results}) == 1
+    assert len(cache) == 1
+
+
+def test_waiter_cancel_does_not_cancel_leader():
+    async def scenario():
+        cache, loader = EntityCache(), _Loader()
+        leader = asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader))
+        await loader.started.wait()
+        waiter = asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader))
+        await _settle()
+        waiter.cancel()
+        loader.release.set()
+        return loader, await leader, waiter
+
+    loader, result, waiter = asyncio.run(scenario())
+    assert waiter.cancelled()
+    assert result.event_ticker == 'T'
+    assert loader.calls == 1
+
+
+@pytest.mark.parametrize('invalidate', [
+    lambda cache: cache.invalidate(KalshiEvent, 'T'),
+    lambda cache: cache.invalidate_id(KalshiEvent, 1),
+])
+def test_invalidation_during_load_prevents_caching(invalidate):
+    async def scenario():
+        cache, loader = EntityCache(), _Loader()
+        task = asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader))
+        await loader.started.wait()
+        invalidate(cache)
+        loader.release.set()
+        first = await task
+        second = await cache.get_or_load(KalshiEvent, 'T', loader)
+        return cache, loader, first, second
+
+    cache, loader, first, second = asyncio.run(scenario())
+    # Результат отдан вызывающему, но не закеширован: второй запрос снова идет в loader
+    assert first.title == 'call 1'
+    assert second.title == 'call 2'
+    assert loader.calls == 2
+    assert len(cache) == 1
+
+
+def test_invalidate_id_drops_cached_entry():
+    async def scenario():
+        cache, loader = EntityCache(), _Loader(entity_id=7)
+        loader.release.set()
+        await cache.get_or_load(KalshiEvent, 'T', loader)
+        cache.invalidate_id(KalshiEvent, 7)
+        await cache.get_or_load(KalshiEvent, 'T', loader)
+        return loader
+
+    assert asyncio.run(scenario()).calls == 2
+
+
+def test_loader_error_reaches_waiters_and_is_not_cached():
+    async def scenario():
+        cache, loader = EntityCache(), _Loader()
+        loader.error = RuntimeError('db down')
+        tasks = [asyncio.create_task(cache.get_or_load(KalshiEvent, 'T', loader)) for _ in range(3)]
+        await _settle()
+        loader.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return cache, loader, results
+
+    cache, loader, results = asyncio.run(scenario())
+    assert loader.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(cache) == 0
+
+
+def test_none_is_not_cached():
+    async def scenario():
+        cache, calls = EntityCache(), []
+
+        async def loader():
+            calls.append(1)
+            return None
+
+        assert await cache.get_or_load(KalshiEvent, 'missing', loader) is None
+        assert await cache.get_or_load(KalshiEvent, 'missing', loader) is None
+        return calls
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+def test_lru_eviction_and_ttl():
+    async def scenario():
+        cache = EntityCache(max_size=2, ttl=30.0)
+        for index, ticker in enumerate(['A', 'B', 'C'], start=1):
+            loader = _Loader(ticker, index)
+            loader.release.set()
+            await cache.get_or_load(KalshiEvent, ticker, loader)
+        keys = [key for _, key in cache._entries]
+
+        expired = EntityCache(ttl=0.0)
+        loader = _Loader()
+        loader.release.set()
+        await expired.get_or_load(KalshiEvent, 'T', loader)
+        await asyncio.sleep(0.01)
+        await expired.get_or_load(KalshiEvent, 'T', loader)
+        return keys, loader.calls
+
+    keys, calls = asyncio.run(scenario())
+    assert keys == ['B', 'C']
+    assert calls == 2
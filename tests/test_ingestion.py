@@ -0,0 +1,112 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from database.services.ingestion import iter_json_array
+
+
+DOCUMENT = [
+    {"id": 1, "price": -12.5e-3, "volume": 1700000000123456789, "ratio": 0.25},
+    {"title": "café \"quoted\" \\ back\\slash", "emoji": "\U0001F600", "tab": "a\tb\nc"},
+    {"flags": [True, False, None], "nested": {"a": [1, 2, [3]], "b": {}}},
+    [],
+    "plain string",
+    12345,
+    -0.5,
+    True,
+    False,
+    None,
+]
+
+
+def _collect(source, **kwargs):
+    async def collect():
+        return [item async for item in iter_json_array(source, **kwargs)]
+    return asyncio.run(collect())
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_every_chunk_boundary(ensure_ascii):
+    # ensure_ascii=True дает \uXXXX и суррогатные пары, False - многобайтный UTF-8
+    encoded = json.dumps(DOCUMENT, ensure_ascii=ensure_ascii).encode('utf-8')
+    for size in range(1, 24):
+        assert _collect(_split(encoded, size)) == DOCUMENT, size
+
+
+def test_split_at_every_position():
+    encoded = json.dumps(DOCUMENT, ensure_ascii=True).encode('utf-8')
+    for cut in range(1, len(encoded)):
+        assert _collect([encoded[:cut], encoded[cut:]]) == DOCUMENT, cut
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[12, 345]', [12, 345]),
+    ('[1.5e10,-2]', [1.5e10, -2]),
+    ('[true,false,null]', [True, False, None]),
+    ('["\\u00e9\\ud83d\\ude00"]', ['é\U0001F600']),
+])
+def test_values_cut_by_single_characters(text, expected):
+    # Числа и литералы, разрезанные границей чанка, не должны разбираться раньше времени
+    assert _collect(list(text)) == expected
+
+
+@pytest.mark.parametrize('source', [
+    io.BytesIO(b' [ {"a": 1} ,\n {"a": 2} ] \n'),
+    io.StringIO('[{"a": 1}, {"a": 2}]'),
+])
+def test_file_objects(source):
+    assert _collect(source, chunk_size=3) == [{"a": 1}, {"a": 2}]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '[]\n'])
+def test_empty_array(text):
+    assert _collect([text]) == []
+
+
+@pytest.mark.parametrize('text', [
+    '[1 2]',
+    '[1,,2]',
+    '[,1]',
+    '[1,]',
+    '[{"a": 1} {"a": 2}]',
+    '[1]]',
+    '[1] 2',
+    '[1],[2]',
+    '{"a": 1}',
+    '[tru]',
+    '[1',
+    '[1,',
+    '',
+    '["unterminated]',
+])
+def test_malformed_input(text):
+    with pytest.raises(ValueError):
+        _collect(list(text))
+    with pytest.raises(ValueError):
+        _collect([text])
+
+
+def test_malformed_input_fails_before_the_end():
+    seen = []
+
+    async def consume():
+        async for item in iter_json_array(['[1, 2, 3 4', ', 5, 6]']):
+            seen.append(item)
+
+    with pytest.raises(ValueError):
+        asyncio.run(consume())
+    assert seen == [1, 2]
+
+
+def test_max_item_size():
+    small = '"' + 'a' * 10 + '"'
+    large = '"' + 'b' * 200 + '"'
+    assert _collect(_split(f'[{small}, {small}]', 7), max_item_size=50) == ['a' * 10] * 2
+    with pytest.raises(ValueError, match='exceeds'):
+        _collect(_split(f'[{small}, {large}]', 7), max_item_size=50)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import event, inspect
+
+from database.CRUDs.MappingEvent_repository import get_mapping_graph
+from database.models.base import Base
+from database.models.KalshiEvent import KalshiEvent
+from database.models.MappingEvent import MappingEvent
+from database.models.PolyMarketEvent import PolyMarketEvent
+from database.services.database import Database
+
+
+KALSHI_EVENTS = 12
+POLYMARKET_EVENTS = 6
+OUTCOMES = ('Yes', 'No')
+
+
+async def _populate(database: Database) -> int:
+    """Создает события и по связи на каждую пару (Kalshi, исход); возвращает число связей"""
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with database.session() as session:
+        session.add_all(
+            KalshiEvent(id=i, event_ticker=f'KX-{i}', title=f'Kalshi {i}')
+            for i in range(1, KALSHI_EVENTS + 1)
+        )
+        session.add_all(
+            PolyMarketEvent(id=i, slug=f'poly-{i}', outcomes=json.dumps(OUTCOMES))
+            for i in range(1, POLYMARKET_EVENTS + 1)
+        )
+        await session.flush()
+        mappings = [
+            MappingEvent(
+                kalshi_id=kalshi_id,
+                polymarket_id=(kalshi_id - 1) % POLYMARKET_EVENTS + 1,
+                polymarket_outcome=outcome,
+                polymarket_clobTokenId=f'token-{kalshi_id}-{outcome}',
+                kalshi_ticker=f'KX-{kalshi_id}',
+            )
+            for kalshi_id in range(1, KALSHI_EVENTS + 1)
+            for outcome in OUTCOMES
+        ]
+        session.add_all(mappings)
+        await session.commit()
+    return len(mappings)
+
+
+def _run_graph(chunk_size: int, **ids):
+    """Загружает граф и возвращает (связи, запросов на загрузку, запросов при обращении к связям)"""
+    async def scenario():
+        database = Database('sqlite+aiosqlite://')
+        try:
+            await _populate(database)
+
+            statements = []
+
+            def count(conn, cursor, statement, parameters, context, executemany):
+                # BEGIN выдает сама SQLite-обертка Database, это не запрос к данным
+                if statement != 'BEGIN':
+                    statements.append(statement)
+
+            event.listen(database.engine.sync_engine, 'before_cursor_execute', count)
+            async with database.session() as session:
+                mappings = await get_mapping_graph(session, chunk_size=chunk_size, **ids)
+                loaded = len(statements)
+                for mapping in mappings:
+                    state = inspect(mapping)
+                    assert 'kalshi_event' not in state.unloaded
+                    assert 'polymarket_event' not in state.unloaded
+                    assert mapping.kalshi_event.id == mapping.kalshi_id
+                    assert mapping.polymarket_event.id == mapping.polymarket_id
+                accessed = len(statements) - loaded
+            return mappings, loaded, accessed
+        finally:
+            await database.engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 100])
+def test_one_query_per_kalshi_id_chunk(chunk_size):
+    kalshi_ids = list(range(1, KALSHI_EVENTS + 1))
+    mappings, loaded, accessed = _run_graph(chunk_size, kalshi_ids=kalshi_ids)
+
+    assert len(mappings) == KALSHI_EVENTS * len(OUTCOMES)
+    assert loaded == -(-len(kalshi_ids) // chunk_size)
+    assert accessed == 0
+
+
+def test_chunks_of_both_id_sets_are_merged_without_duplicates():
+    mappings, loaded, accessed = _run_graph(4, kalshi_ids=[1, 2, 3], polymarket_ids=[1, 2])
+
+    # Kalshi 1..3 и все Kalshi, связанные с Polymarket 1 и 2 (1, 2, 7, 8)
+    expected_kalshi = {1, 2, 3, 7, 8}
+    assert sorted(mapping.kalshi_id for mapping in mappings) == sorted(
+        kalshi_id for kalshi_id in expected_kalshi for _ in OUTCOMES
+    )
+    assert [mapping.id for mapping in mappings] == sorted({mapping.id for mapping in mappings})
+    assert loaded == 2
+    assert accessed == 0
+
+
+def test_no_ids_no_queries():
+    mappings, loaded, accessed = _run_graph(10)
+
+    assert mappings == []
+    assert loaded == 0
+    assert accessed == 0